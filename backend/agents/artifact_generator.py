@@ -1,13 +1,36 @@
+import asyncio
 import logging
+import os
+import time
 
+from backend import jobs, metrics
 from backend.agents.base import forced_tool_call
 from backend.api import artifact_store
-from backend.api.lesson_plan_store import get_plan
-from backend.api.module_store import get_modules
+from backend.api.lesson_plan_store import get_plan, get_plan_report
+from backend.api.module_store import get_module, get_modules
 from backend.config import MODEL_GENERATOR
 
 MODEL = MODEL_GENERATOR
 
+# Max generator calls in flight for one plan-level job
+CONCURRENCY = int(os.environ.get("ARTIFACT_CONCURRENCY", "6"))
+# A 'generating' claim is renewed every CLAIM_LEASE / 3 while its generation
+# runs; one not renewed for CLAIM_LEASE is assumed abandoned by a dead worker.
+CLAIM_LEASE = float(os.environ.get("ARTIFACT_CLAIM_LEASE", "30"))
+# How often a request waiting on another worker's generation re-reads the row
+POLL_INTERVAL = 1.0
+
+# Generations running in this process, by artifact id
+_inflight: dict[int, asyncio.Task] = {}
+
+# Shared by every generator call so the cached prompt prefix (tools, system,
+# rubric, module sequence) is byte-identical across a plan's artifacts. The
+# per-type instructions live in the uncached suffix instead.
+SYSTEM = (
+    "You generate learning artifacts for one module of a curriculum. "
+    "Follow the artifact instructions and call the requested tool."
+)
+
 GENERATORS = {
     "flashcards": {
         "system": "Generate 5-8 flashcards for this module.",
@@ -207,30 +230,124 @@ GENERATORS = {
 }
 
 
-async def generate_artifact(artifact: dict, module: dict) -> None:
-    generator = GENERATORS.get(artifact["type"])
-    if not generator:
+TOOLS = [g["tool"] for g in GENERATORS.values()]
+
+
+async def generate_artifact(
+    artifact: dict,
+    module: dict,
+    plan: dict | None = None,
+    siblings: list[dict] | None = None,
+    regenerate: bool = False,
+) -> None:
+    """Generate and save one artifact's content.
+
+    Pass `plan` and `siblings` when generating many artifacts of one plan to
+    skip re-reading them for every call. Identical requests are served from
+    the response cache unless `regenerate` asks for fresh content.
+
+    Single flight per artifact: a concurrent call in this process awaits the
+    generation already running, and one in another process polls until that
+    worker's 'generating' claim is released.
+    """
+    if artifact["type"] not in GENERATORS:
         return
+    artifact_id = artifact["id"]
+    task = _inflight.get(artifact_id)
+    if task is not None:
+        metrics.incr("artifacts.generate.joined")
+    else:
+        task = asyncio.create_task(
+            _claim_and_generate(artifact, module, plan, siblings, regenerate)
+        )
+        _inflight[artifact_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(artifact_id, None))
+    # Shielded: one waiter going away must not cancel everyone's generation.
+    await asyncio.shield(task)
+
+
+async def _claim_and_generate(artifact, module, plan, siblings, regenerate) -> None:
+    while not await artifact_store.claim_artifact(artifact["id"], CLAIM_LEASE):
+        metrics.incr("artifacts.generate.waited")
+        if await _wait_for_release(artifact["id"]):
+            return
+        # The other worker's claim went stale; try to take it over.
+    heartbeat = asyncio.create_task(_heartbeat(artifact["id"]))
+    data = None
+    try:
+        data = await _generate(artifact, module, plan, siblings, regenerate)
+    finally:
+        heartbeat.cancel()
+        if heartbeat.done() and not heartbeat.cancelled() and heartbeat.exception():
+            logging.error(
+                "artifact_generator: claim heartbeat for id=%d died: %r",
+                artifact["id"], heartbeat.exception(),
+            )
+        await artifact_store.release_artifact(artifact["id"], data)
+    if data:
+        logging.info(
+            "artifact_generator: saved %s id=%d", artifact["type"], artifact["id"]
+        )
+
+
+async def _heartbeat(artifact_id: int) -> None:
+    while True:
+        await asyncio.sleep(CLAIM_LEASE / 3)
+        try:
+            await artifact_store.renew_claim(artifact_id)
+        except Exception:
+            # Keep going: the lease has two more renewals before it runs out.
+            logging.exception("artifact_generator: renewing claim on id=%d failed", artifact_id)
+            metrics.incr("artifacts.claim.renew_failed")
+
+
+async def _wait_for_release(artifact_id: int) -> bool:
+    """Poll until another worker finishes. False if its claim went stale first."""
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        current = await artifact_store.get_artifact(artifact_id)
+        if current is None or current["status"] != "generating":
+            return True
+        if time.time() - (current["generating_since"] or 0) > CLAIM_LEASE:
+            return False
+
+
+async def _generate(
+    artifact: dict,
+    module: dict,
+    plan: dict | None,
+    siblings: list[dict] | None,
+    regenerate: bool,
+) -> dict | None:
+    """Run the generator call; returns the artifact data (not yet saved)."""
+    generator = GENERATORS[artifact["type"]]
     logging.info(
         "artifact_generator: generating %s for module %d",
         artifact["type"],
         module["id"],
     )
 
-    plan = await get_plan(module["plan_id"])
-    siblings = await get_modules(module["plan_id"])
+    if plan is None:
+        plan = await get_plan(module["plan_id"])
+    if siblings is None:
+        siblings = await get_modules(module["plan_id"])
 
     sequence = "\n".join(
         f"  {m['position']}. [{m['type']}] {m['name']} — {m['description']}"
-        + (" ← THIS MODULE" if m["id"] == module["id"] else "")
         for m in siblings
     )
 
-    user_content = (
+    # Identical for every module of the plan; cache_control marks the end of
+    # the prefix so later generations read it from cache.
+    shared = (
         f"# Learning Goal\n{plan['title']}\n\n"
         f"# Curriculum Rubric\n{plan['plan']}\n\n"
-        f"# Module Sequence\n{sequence}\n\n"
+        f"# Module Sequence\n{sequence}"
+    )
+    target = (
+        f"# Artifact\n{generator['system']}\n\n"
         f"# Target Module\n"
+        f"Position: {module['position']}\n"
         f"Name: {module['name']}\n"
         f"Type: {module['type']}\n"
         f"Description: {module['description']}\n\n"
@@ -238,13 +355,119 @@ async def generate_artifact(artifact: dict, module: dict) -> None:
     )
 
     result = await forced_tool_call(
-        system=generator["system"],
-        user_content=user_content,
+        system=SYSTEM,
+        user_content=[
+            {"type": "text", "text": shared, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": target},
+        ],
         tool=generator["tool"],
+        tools=TOOLS,
         model=MODEL,
+        cache=True,
+        refresh=regenerate,
     )
-    if result:
-        await artifact_store.update_artifact(artifact["id"], result)
-        logging.info(
-            "artifact_generator: saved %s id=%d", artifact["type"], artifact["id"]
-        )
+    return result or None
+
+
+async def release_stale_claims() -> None:
+    """Reset claims left behind by a worker that died (call at startup)."""
+    released = await artifact_store.release_stale_claims(CLAIM_LEASE)
+    if released:
+        logging.info("artifact_generator: released %d stale generation claims", released)
+
+
+async def cancel_generations() -> None:
+    """Cancel this process's generations and release their claims.
+
+    Call at shutdown, while the database is still open: generations are
+    shielded from their callers, so stopping the job workers leaves them running.
+    """
+    tasks = list(_inflight.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _pending(report: dict) -> list[tuple[dict, dict]]:
+    return [
+        (a, m)
+        for m in report["modules"]
+        for a in m["artifacts"]
+        if not a["data"] and a["type"] in GENERATORS
+    ]
+
+
+async def _run_plan_artifacts(job: dict) -> None:
+    """Job handler: generate every still-empty artifact of a plan.
+
+    Each artifact reports its own progress; the attempt fails if any of them
+    did, so the job ends 'failed' once its attempts run out.
+    """
+    plan_id = job["payload"]["plan_id"]
+    report = await get_plan_report(plan_id)
+    if report is None:
+        return None
+    # Re-read on every attempt, so a retry only redoes what is still empty.
+    pending = _pending(report)
+    await jobs.set_total(job, len(pending))
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(artifact: dict, module: dict) -> None:
+        async with semaphore:
+            try:
+                await generate_artifact(artifact, module, report, report["modules"])
+            except Exception as exc:
+                logging.exception(
+                    "artifact_generator: failed artifact id=%d", artifact["id"]
+                )
+                await jobs.progress(job, ok=False, error=f"artifact {artifact['id']}: {exc}")
+            else:
+                await jobs.progress(job, ok=True)
+
+    logging.info(
+        "artifact_generator: plan %d — generating %d artifacts", plan_id, len(pending)
+    )
+    await asyncio.gather(*(one(a, m) for a, m in pending))
+    if job["failed"]:
+        # Fail the attempt so the job retries; the retry skips what was saved.
+        raise RuntimeError(f"{job['failed']}/{len(pending)} artifacts failed")
+    return None
+
+
+jobs.register("plan_artifacts", _run_plan_artifacts, concurrency=2)
+
+
+async def _run_artifact(job: dict) -> dict | None:
+    """Job handler: generate one artifact; the result is {"artifact_id"}."""
+    artifact_id = job["payload"]["artifact_id"]
+    regenerate = job["payload"].get("regenerate", False)
+    artifact = await artifact_store.get_artifact(artifact_id)
+    if artifact is None:
+        return None
+    # An earlier attempt may have saved it already.
+    if not artifact["data"] or regenerate:
+        module = await get_module(artifact["module_id"])
+        await generate_artifact(artifact, module, regenerate=regenerate)
+    return {"artifact_id": artifact_id}
+
+
+jobs.register("artifact", _run_artifact, concurrency=CONCURRENCY)
+
+
+async def submit_artifact(artifact_id: int, regenerate: bool = False) -> dict:
+    """Queue generation of one artifact; returns the job."""
+    return await jobs.submit(
+        "artifact", {"artifact_id": artifact_id, "regenerate": regenerate}, total=1
+    )
+
+
+async def generate_plan_artifacts(plan_id: int) -> dict | None:
+    """Queue a job generating every empty artifact of a plan.
+
+    Calls fan out with at most CONCURRENCY in flight. Returns the job, or None
+    if the plan does not exist.
+    """
+    report = await get_plan_report(plan_id)
+    if report is None:
+        return None
+    return await jobs.submit("plan_artifacts", {"plan_id": plan_id}, len(_pending(report)))
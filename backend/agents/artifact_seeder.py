@@ -1,7 +1,9 @@
 import logging
 
+from backend import jobs
 from backend.agents.base import forced_tool_call
 from backend.api import artifact_store
+from backend.api.lesson_plan_store import get_plan_report
 from backend.config import MODEL_PLANNER
 
 MODEL = MODEL_PLANNER
@@ -44,9 +46,9 @@ SEED_ARTIFACTS_TOOL = {
 }
 
 
-async def seed_artifacts(modules: list[dict]) -> None:
+async def seed_artifacts(modules: list[dict]) -> list[dict]:
     if not modules:
-        return
+        return []
     logging.info("artifact_seeder: seeding %d modules", len(modules))
     module_list = "\n".join(
         f"- id={m['id']} name={m['name']!r} type={m['type']} description={m['description']!r}"
@@ -60,5 +62,58 @@ async def seed_artifacts(modules: list[dict]) -> None:
     )
     assignments = result.get("assignments", [])
     logging.info("artifact_seeder: got %d assignments", len(assignments))
-    if assignments:
-        await artifact_store.save_artifacts(assignments)
+    return await artifact_store.save_artifacts(assignments)
+
+
+async def _run_seed_artifacts(job: dict) -> dict | None:
+    """Job handler: seed artifact stubs for a saved plan's modules."""
+    report = await get_plan_report(job["payload"]["plan_id"])
+    if report is None:
+        return None
+    existing = sum(len(m["artifacts"]) for m in report["modules"])
+    if existing:
+        # An earlier attempt already saved them.
+        return {"artifacts": existing}
+    modules = [{k: m[k] for k in ("id", "name", "type", "description")} for m in report["modules"]]
+    return {"artifacts": len(await seed_artifacts(modules))}
+
+
+jobs.register("seed_artifacts", _run_seed_artifacts, concurrency=2)
+
+
+async def submit_seed_artifacts(plan_id: int) -> dict:
+    """Queue artifact seeding for a newly saved plan; returns the job."""
+    return await jobs.submit("seed_artifacts", {"plan_id": plan_id})
+
+
+async def save_assigned(saved_modules: list[dict], modules: list[dict]) -> list[dict] | None:
+    """Save the artifact types the planner already picked for each module.
+
+    `modules` are the planner's modules, in the order `saved_modules` were
+    inserted. Returns None, saving nothing, unless every module has at least
+    one known type; the plan is then seeded with a separate call instead.
+    """
+    if not saved_modules or len(saved_modules) != len(modules):
+        return None
+    assignments = []
+    for saved, module in zip(saved_modules, modules):
+        types = [t for t in module.get("artifacts") or [] if t in ARTIFACT_TYPES][:2]
+        if not types:
+            return None
+        assignments += [{"module_id": saved["id"], "type": t} for t in dict.fromkeys(types)]
+    return await artifact_store.save_artifacts(assignments)
+
+
+async def seed_plan(plan_id: int, saved_modules: list[dict], modules: list[dict]) -> dict | None:
+    """Seed artifact stubs for a plan that was just saved.
+
+    Uses the planner's own assignments when it made them (pipelined mode),
+    otherwise queues the seed_artifacts job. Returns that job, or None.
+    """
+    if not saved_modules:
+        return None
+    saved = await save_assigned(saved_modules, modules)
+    if saved is not None:
+        logging.info("artifact_seeder: saved %d planner-assigned artifacts", len(saved))
+        return None
+    return await submit_seed_artifacts(plan_id)
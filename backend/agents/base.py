@@ -1,28 +1,104 @@
+import hashlib
+import json
+import logging
 import os
-from anthropic import AsyncAnthropic
-from dotenv import load_dotenv
 
-load_dotenv()
+from backend import llm, metrics
+from backend.api import llm_cache_store
 
-client = AsyncAnthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+log = logging.getLogger(__name__)
+
+# Response cache for forced tool calls that opt in with cache=True.
+# LLM_CACHE=0 turns it off everywhere.
+CACHE_ENABLED = os.environ.get("LLM_CACHE", "1") != "0"
+CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(float(os.environ.get("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+
+def record_usage(label: str, usage) -> None:
+    """Log one response's token usage and add it to the llm.* counters."""
+    cache_read = usage.cache_read_input_tokens or 0
+    cache_write = usage.cache_creation_input_tokens or 0
+    log.info(
+        "%s usage: input=%d cache_read=%d cache_write=%d output=%d",
+        label, usage.input_tokens, cache_read, cache_write, usage.output_tokens,
+    )
+    metrics.incr("llm.input_tokens", usage.input_tokens)
+    metrics.incr("llm.cache_read_tokens", cache_read)
+    metrics.incr("llm.cache_write_tokens", cache_write)
+    metrics.incr("llm.output_tokens", usage.output_tokens)
+
+
+# Rough output size of a token, for text we streamed before usage arrived.
+_CHARS_PER_TOKEN = 4
+
+
+def record_abort(label: str, max_tokens: int, streamed_chars: int = 0) -> None:
+    """Count a stream closed early because its client went away.
+
+    Tokens saved is an estimate (upper bound): the unused part of max_tokens
+    after what was already streamed.
+    """
+    saved = max(0, max_tokens - streamed_chars // _CHARS_PER_TOKEN)
+    log.info("%s: stream aborted, ~%d output tokens saved", label, saved)
+    metrics.incr("llm.aborted_streams")
+    metrics.incr("llm.tokens_saved", saved)
+
+
+def _cache_key(model, system, tools, tool_name, user_content, max_tokens) -> str:
+    request = [model, system, tools, tool_name, user_content, max_tokens]
+    data = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
 
 
 async def forced_tool_call(
     system: str,
-    user_content: str,
+    user_content: str | list[dict],
     tool: dict,
     model: str,
     max_tokens: int = 2048,
+    tools: list[dict] | None = None,
+    cache: bool = False,
+    refresh: bool = False,
 ) -> dict:
-    response = await client.messages.create(
+    """Force a call to `tool` and return its input.
+
+    `tools` is the full tool list to send when it should be wider than `tool`
+    alone (e.g. to keep a cacheable prefix identical across calls).
+    `user_content` may be a list of content blocks carrying cache_control.
+
+    With `cache`, an identical earlier request is answered from the response
+    cache; `refresh` skips the lookup (regenerate) but still stores the result.
+    """
+    tools = tools or [tool]
+    key = None
+    if cache and CACHE_ENABLED:
+        key = _cache_key(model, system, tools, tool["name"], user_content, max_tokens)
+        if refresh:
+            metrics.incr("llm.cache.bypassed")
+        else:
+            cached = await llm_cache_store.get_response(key, CACHE_TTL)
+            if cached is not None:
+                metrics.incr("llm.cache.hits")
+                log.info("%s: response cache hit", tool["name"])
+                return cached
+            metrics.incr("llm.cache.misses")
+
+    response = await llm.create(
         model=model,
         max_tokens=max_tokens,
         system=system,
-        tools=[tool],
-        tool_choice={"type": "any"},
+        tools=tools,
+        tool_choice={"type": "tool", "name": tool["name"]},
         messages=[{"role": "user", "content": user_content}],
     )
+    record_usage(tool["name"], response.usage)
     for block in response.content:
         if block.type == "tool_use" and block.name == tool["name"]:
+            if key is not None and block.input:
+                evicted = await llm_cache_store.put_response(
+                    key, tool["name"], block.input, CACHE_TTL, CACHE_MAX_BYTES
+                )
+                metrics.incr("llm.cache.evictions", evicted)
             return block.input
     return {}
@@ -1,15 +1,22 @@
 import logging
+import os
 
-from backend.agents.base import client, forced_tool_call
+from backend import jobs, llm
+from backend.agents.artifact_seeder import ARTIFACT_TYPES, seed_plan
+from backend.agents.base import forced_tool_call
+from backend.api.lesson_plan_store import create_plan, get_plan_report
 from backend.config import MODEL_PLANNER
 
 MODEL = MODEL_PLANNER
 
-PLAN_SYSTEM_PROMPT = """You are an expert curriculum designer. Given a learner's free-text description of what they want to learn, produce a lesson plan overview in markdown.
+# Pipelined mode writes the overview, the modules and their artifact types in
+# one structured call. PLANNER_PIPELINED=0 restores the two-step planner
+# (markdown, then extraction) with a separate seeding call after the save.
+PIPELINED = os.environ.get("PLANNER_PIPELINED", "1") != "0"
 
-Output ONLY the markdown — no preamble, no commentary, nothing before the H1.
+_PLAN_INTRO = "You are an expert curriculum designer. Given a learner's free-text description of what they want to learn, produce a lesson plan overview in markdown."
 
-The overview must follow this exact structure:
+_PLAN_STRUCTURE = """The overview must follow this exact structure:
 
 # {Concise, specific title for the learning goal}
 
@@ -28,6 +35,20 @@ The overview must follow this exact structure:
 5. {Module title} — {one-line description}
 6. {Module title} — {one-line description}"""
 
+PLAN_SYSTEM_PROMPT = (
+    _PLAN_INTRO
+    + "\n\nOutput ONLY the markdown — no preamble, no commentary, nothing before the H1.\n\n"
+    + _PLAN_STRUCTURE
+)
+
+PIPELINED_SYSTEM_PROMPT = (
+    _PLAN_INTRO
+    + " Then break it down into structured modules and pick the practice artifacts for each."
+    + "\n\nCall save_lesson_plan once. Its markdown field holds the overview — no preamble, nothing before the H1.\n\n"
+    + _PLAN_STRUCTURE
+    + "\n\nIts modules field lists every curriculum module in the same order, each with 1-2 artifact types that best suit its type and learning goal."
+)
+
 EXTRACT_SYSTEM_PROMPT = """You extract structured module data from curriculum plans. When given a lesson plan overview and the original learner intake answers, call save_modules with the full detailed breakdown for each module in the curriculum."""
 
 SAVE_MODULES_TOOL = {
@@ -59,12 +80,66 @@ SAVE_MODULES_TOOL = {
 }
 
 
-async def generate_lesson_plan(prompt: str) -> tuple[str, list[dict]]:
+_MODULE_SCHEMA = SAVE_MODULES_TOOL["input_schema"]["properties"]["modules"]["items"]
+
+SAVE_LESSON_PLAN_TOOL = {
+    "name": "save_lesson_plan",
+    "description": "Record the lesson plan overview, its modules, and the artifact types for each module.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            # First, so the overview is written before the breakdown of it.
+            "markdown": {"type": "string", "description": "The lesson plan overview in markdown"},
+            "modules": {
+                "type": "array",
+                "description": "The modules in order, one per curriculum overview item",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        **_MODULE_SCHEMA["properties"],
+                        "artifacts": {
+                            "type": "array",
+                            "description": "1-2 artifact types for this module",
+                            "items": {"type": "string", "enum": ARTIFACT_TYPES},
+                        },
+                    },
+                    "required": [*_MODULE_SCHEMA["required"], "artifacts"],
+                },
+            },
+        },
+        "required": ["markdown", "modules"],
+    },
+}
+
+
+async def _generate_pipelined(intake: str) -> tuple[str, list[dict]]:
+    logging.info("course_planner: generating plan, modules and artifacts in one call")
+    result = await forced_tool_call(
+        system=PIPELINED_SYSTEM_PROMPT,
+        user_content=f"{intake}\n\nGenerate the lesson plan now.",
+        tool=SAVE_LESSON_PLAN_TOOL,
+        model=MODEL,
+        max_tokens=4096,
+    )
+    plan_text = result.get("markdown", "").strip()
+    modules = result.get("modules", [])
+    logging.info("course_planner: plan_text length=%d, captured %d modules", len(plan_text), len(modules))
+    return plan_text, modules
+
+
+async def generate_lesson_plan(prompt: str, pipelined: bool | None = None) -> tuple[str, list[dict]]:
+    """Generate a plan's overview markdown and its modules.
+
+    In pipelined mode (default: PIPELINED) each module also carries the
+    `artifacts` types to seed it with, so saving the plan needs no further call.
+    """
     intake = prompt
+    if PIPELINED if pipelined is None else pipelined:
+        return await _generate_pipelined(intake)
 
     # Step 1: Generate the plan overview markdown
     logging.info("course_planner: step 1 — generating plan overview")
-    plan_response = await client.messages.create(
+    plan_response = await llm.create(
         model=MODEL,
         max_tokens=2048,
         system=PLAN_SYSTEM_PROMPT,
@@ -81,8 +156,70 @@ async def generate_lesson_plan(prompt: str) -> tuple[str, list[dict]]:
         user_content=f"Learner intake:\n{intake}\n\nCurriculum overview:\n{plan_text}\n\nCall save_modules with the full breakdown for each module.",
         tool=SAVE_MODULES_TOOL,
         model=MODEL,
+        cache=True,
     )
     captured_modules = result.get("modules", [])
     logging.info("course_planner: captured %d modules", len(captured_modules))
 
     return plan_text, captured_modules
+
+
+def plan_title(markdown: str) -> str:
+    """The overview's H1, or a placeholder if it has none."""
+    return next(
+        (line.lstrip("#").strip() for line in markdown.splitlines() if line.startswith("# ")),
+        "New Lesson Plan",
+    )
+
+
+async def _save_plan(job: dict, result: dict) -> dict:
+    """Save a generated plan and seed its artifacts, once per job."""
+    if "plan_id" in result:
+        # An earlier attempt saved the plan; seed it unless that happened too.
+        report = await get_plan_report(result["plan_id"])
+        saved = report["modules"] if report else []
+        if any(m["artifacts"] for m in saved):
+            return result
+    else:
+        title = plan_title(result["markdown"])
+        plan_id, saved = await create_plan(title, result["markdown"], result["modules"])
+        result = {**result, "plan_id": plan_id, "title": title}
+        await jobs.checkpoint(job, result)
+    await seed_plan(result["plan_id"], saved, result["modules"])
+    return result
+
+
+async def _run_lesson_plan(job: dict) -> dict:
+    """Job handler: generate a plan; the result is {"markdown", "modules"}.
+
+    With `save` in the payload it also saves the plan and seeds its artifacts,
+    adding {"plan_id", "title"} to the result. Each step is checkpointed on the
+    job, so a retry never generates or saves the same plan twice.
+    """
+    save = job["payload"].get("save", False)
+    result = job["result"] or {}
+    if "markdown" not in result:
+        markdown, modules = await generate_lesson_plan(job["payload"]["prompt"])
+        logging.info("generate: plan_length=%d modules=%d", len(markdown), len(modules))
+        if not markdown:
+            logging.warning("generate: plan text is empty")
+        if not modules:
+            logging.warning("generate: no modules captured")
+        result = {"markdown": markdown, "modules": modules}
+        if save:
+            await jobs.checkpoint(job, result)
+    if save:
+        result = await _save_plan(job, result)
+    return result
+
+
+jobs.register("lesson_plan", _run_lesson_plan, concurrency=2)
+
+
+async def submit_lesson_plan(prompt: str, save: bool = False) -> dict:
+    """Queue plan generation; the finished job's result holds the plan.
+
+    With `save`, the job also saves the plan, so it is kept even if whoever
+    submitted it stops waiting.
+    """
+    return await jobs.submit("lesson_plan", {"prompt": prompt, "save": save})
@@ -1,7 +1,13 @@
+import asyncio
 import json
-from backend.agents.base import client
+from contextlib import aclosing
+
+from backend import llm
+from backend.agents.base import record_abort
 from backend.config import MODEL_CHAT
 
+MAX_TOKENS = 256
+
 
 def _system_prompt(label: str, topic: str, points: list[str]) -> str:
     bullet_list = "\n".join(f"- {p}" for p in points)
@@ -34,26 +40,90 @@ def _build_msgs(thread: list[dict]) -> list[dict]:
     return msgs
 
 
+def _turn_msgs(thread, opponent_last, opponent_name, mediator_text) -> list[dict]:
+    msgs = _build_msgs(thread)
+
+    # Build the new user message
+    parts = []
+    if opponent_last:
+        parts.append(f"[{opponent_name}'s latest statement]: {opponent_last}")
+    if mediator_text:
+        parts.append(f"[Mediator]: {mediator_text}")
+
+    if parts:
+        msgs.append({"role": "user", "content": "\n\n".join(parts)})
+    elif not msgs:
+        msgs.append(
+            {
+                "role": "user",
+                "content": "The mediator has opened the floor. Present your opening perspective.",
+            }
+        )
+    return msgs
+
+
 async def _stream_bot(bot_id, name, system, msgs):
     """Yield SSE events for a single bot turn. Returns full response text."""
     yield f"event: speaker\ndata: {json.dumps({'id': bot_id, 'name': name})}\n\n"
 
     full_content = ""
-    async with client.messages.stream(
-        model=MODEL_CHAT,
-        max_tokens=256,
-        system=system,
-        messages=msgs,
-    ) as stream:
-        async for text in stream.text_stream:
-            full_content += text
-            yield f"event: delta\ndata: {json.dumps({'id': bot_id, 'text': text})}\n\n"
+    try:
+        async with llm.stream(
+            priority=llm.INTERACTIVE,
+            model=MODEL_CHAT,
+            max_tokens=MAX_TOKENS,
+            system=system,
+            messages=msgs,
+        ) as stream:
+            async for text in stream.text_stream:
+                full_content += text
+                yield f"event: delta\ndata: {json.dumps({'id': bot_id, 'text': text})}\n\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        record_abort(f"mediator.{bot_id}", MAX_TOKENS, len(full_content))
+        raise
 
     yield f"event: turn_done\ndata: {json.dumps({'id': bot_id, 'content': full_content})}\n\n"
     # Stash the full content so the caller can read it
     yield full_content
 
 
+async def _pump(gen, queue: asyncio.Queue) -> None:
+    """Forward a bot's SSE events to `queue`; end with None, or the exception."""
+    try:
+        async for chunk in gen:
+            if chunk.startswith("event:"):
+                queue.put_nowait(chunk)
+    except Exception as e:
+        queue.put_nowait(e)
+    else:
+        queue.put_nowait(None)
+
+
+async def _stream_parallel(turns):
+    """Run several bot turns at once, interleaving their events as they arrive.
+
+    Events carry the bot `id`, so the client can route them. If the consumer
+    goes away (client disconnect closes this generator) or one turn fails,
+    the remaining upstream streams are cancelled, which closes them.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    tasks = [asyncio.create_task(_pump(_stream_bot(*turn), queue)) for turn in turns]
+    try:
+        running = len(tasks)
+        while running:
+            item = await queue.get()
+            if item is None:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 async def mediator_stream(
     topic: str,
     bot_a_name: str,
@@ -64,13 +134,16 @@ async def mediator_stream(
     thread_b: list[dict],
     target: str,
     question: str,
+    parallel_opening: bool = False,
 ):
     """
     Single-turn round (except opening which is 2 turns).
       "a"        — A speaks (with optional mediator question)
       "b"        — B speaks (with optional mediator question)
       "continue" — whichever side didn't speak last goes next
-    Opening (both threads empty): both speak, A then B.
+    Opening (both threads empty): both speak, A then B. With
+    `parallel_opening`, both open at once without seeing each other's
+    statement, and their delta events interleave on the stream.
     """
     system_a = _system_prompt(bot_a_name, topic, bot_a_points)
     system_b = _system_prompt(bot_b_name, topic, bot_b_points)
@@ -81,6 +154,19 @@ async def mediator_stream(
     # Opening: both threads empty → both bots give opening statements
     opening = not thread_a and not thread_b
 
+    if opening and parallel_opening:
+        turns = [
+            ("a", bot_a_name, system_a, _turn_msgs(thread_a, None, bot_b_name, "")),
+            ("b", bot_b_name, system_b, _turn_msgs(thread_b, None, bot_a_name, "")),
+        ]
+        # aclosing: a client disconnect closes this generator, and that must
+        # reach the inner generator's cleanup now, not whenever it is collected.
+        async with aclosing(_stream_parallel(turns)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+        yield "event: done\ndata: {}\n\n"
+        return
+
     if opening:
         order = [
             ("a", bot_a_name, system_a, thread_a, None, bot_b_name, ""),
@@ -113,32 +199,16 @@ async def mediator_stream(
         if opening and first_response is not None:
             opponent_last = first_response
 
-        msgs = _build_msgs(thread)
-
-        # Build the new user message
-        parts = []
-        if opponent_last:
-            parts.append(f"[{opponent_name}'s latest statement]: {opponent_last}")
-        if mediator_text:
-            parts.append(f"[Mediator]: {mediator_text}")
-
-        if parts:
-            msgs.append({"role": "user", "content": "\n\n".join(parts)})
-        elif not msgs:
-            msgs.append(
-                {
-                    "role": "user",
-                    "content": "The mediator has opened the floor. Present your opening perspective.",
-                }
-            )
+        msgs = _turn_msgs(thread, opponent_last, opponent_name, mediator_text)
 
         # Stream this bot's response
         full_content = ""
-        async for chunk in _stream_bot(bot_id, name, system, msgs):
-            if not chunk.startswith("event:"):
-                full_content = chunk  # last yield is the full text
-            else:
-                yield chunk
+        async with aclosing(_stream_bot(bot_id, name, system, msgs)) as chunks:
+            async for chunk in chunks:
+                if not chunk.startswith("event:"):
+                    full_content = chunk  # last yield is the full text
+                else:
+                    yield chunk
 
         if first_response is None:
             first_response = full_content
@@ -1,31 +1,28 @@
 import json
-from backend.api.db import get_db
+import time
 
-
-async def create_table() -> None:
-    async with get_db() as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS artifacts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                module_id INTEGER NOT NULL REFERENCES modules(id) ON DELETE CASCADE,
-                type TEXT NOT NULL,
-                data TEXT NOT NULL DEFAULT '{}',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )"""
-        )
-        await db.commit()
+from backend.api.db import get_db, get_writer
 
 
-async def save_artifacts(assignments: list[dict]) -> None:
-    """Bulk insert artifact stubs. Each dict must have module_id and type."""
-    async with get_db() as db:
-        for a in assignments:
-            await db.execute(
-                "INSERT INTO artifacts (module_id, type) VALUES (?, ?)",
-                (a["module_id"], a["type"]),
-            )
+async def save_artifacts(assignments: list[dict]) -> list[dict]:
+    """Bulk insert artifact stubs and return the new rows. Each dict must have module_id and type."""
+    if not assignments:
+        return []
+    params = [v for a in assignments for v in (a["module_id"], a["type"])]
+    values = ", ".join(["(?, ?)"] * len(assignments))
+    async with get_writer() as db:
+        async with db.execute(
+            f"INSERT INTO artifacts (module_id, type) VALUES {values} RETURNING *",
+            params,
+        ) as cursor:
+            rows = await cursor.fetchall()
         await db.commit()
+    result = []
+    for row in sorted(rows, key=lambda r: r["id"]):
+        d = dict(row)
+        d["data"] = json.loads(d["data"])
+        result.append(d)
+    return result
 
 
 async def get_artifacts(module_id: int) -> list[dict]:
@@ -56,7 +53,7 @@ async def get_artifact(artifact_id: int) -> dict | None:
 
 
 async def update_artifact(artifact_id: int, data: dict) -> None:
-    async with get_db() as db:
+    async with get_writer() as db:
         await db.execute(
             "UPDATE artifacts SET data = ? WHERE id = ?",
             (json.dumps(data), artifact_id),
@@ -64,7 +61,76 @@ async def update_artifact(artifact_id: int, data: dict) -> None:
         await db.commit()
 
 
+async def claim_artifact(artifact_id: int, stale_after: float) -> bool:
+    """Mark an artifact 'generating' unless someone else already is.
+
+    A claim not renewed for `stale_after` seconds is treated as abandoned
+    (its worker died) and can be taken over. Returns True if this caller holds it.
+    """
+    now = time.time()
+    async with get_writer() as db:
+        cursor = await db.execute(
+            """UPDATE artifacts SET status = 'generating', generating_since = ?
+               WHERE id = ? AND (status != 'generating' OR generating_since < ?)""",
+            (now, artifact_id, now - stale_after),
+        )
+        await db.commit()
+        return cursor.rowcount == 1
+
+
+async def renew_claim(artifact_id: int) -> None:
+    """Extend a held generation claim; its worker calls this while it runs."""
+    async with get_writer() as db:
+        await db.execute(
+            "UPDATE artifacts SET generating_since = ? WHERE id = ? AND status = 'generating'",
+            (time.time(), artifact_id),
+        )
+        await db.commit()
+
+
+async def release_stale_claims(stale_after: float) -> int:
+    """Reset claims not renewed for `stale_after` seconds. Returns how many."""
+    async with get_writer() as db:
+        cursor = await db.execute(
+            """UPDATE artifacts SET status = 'idle', generating_since = NULL
+               WHERE status = 'generating' AND generating_since < ?""",
+            (time.time() - stale_after,),
+        )
+        await db.commit()
+        return cursor.rowcount
+
+
+async def release_artifact(artifact_id: int, data: dict | None = None) -> None:
+    """Drop the generation claim, saving the generated `data` if given."""
+    async with get_writer() as db:
+        if data is None:
+            await db.execute(
+                "UPDATE artifacts SET status = 'idle', generating_since = NULL WHERE id = ?",
+                (artifact_id,),
+            )
+        else:
+            await db.execute(
+                """UPDATE artifacts SET data = ?, status = 'idle', generating_since = NULL
+                   WHERE id = ?""",
+                (json.dumps(data), artifact_id),
+            )
+        await db.commit()
+
+
 async def delete_artifact(artifact_id: int) -> None:
-    async with get_db() as db:
+    async with get_writer() as db:
         await db.execute("DELETE FROM artifacts WHERE id = ?", (artifact_id,))
         await db.commit()
+
+
+def score_artifact(artifact: dict) -> dict | None:
+    """Score a completed quiz or checklist. Returns {"done", "total"} or None."""
+    d = artifact["data"]
+    if artifact["type"] == "quiz" and d.get("responses"):
+        qs, rs = d["questions"], d["responses"]
+        done = sum(1 for q, r in zip(qs, rs) if r["selected"] == q["answer"])
+        return {"done": done, "total": len(qs)}
+    if artifact["type"] == "checklist" and d.get("items"):
+        done = sum(1 for c in d.get("checked", []) if c)
+        return {"done": done, "total": len(d["items"])}
+    return None
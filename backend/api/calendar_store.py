@@ -0,0 +1,122 @@
+from backend.api.db import get_db, get_writer
+
+# Local mirror of the primary Google Calendar, kept current by
+# google_calendar.sync_events(). Only timed events are stored.
+
+CALENDAR_ID = "primary"
+
+
+async def get_sync_state() -> dict | None:
+    """Return {sync_token, synced_at, max_duration} or None before the first sync."""
+    async with get_db() as db:
+        async with db.execute(
+            "SELECT sync_token, synced_at, max_duration FROM calendar_sync WHERE calendar_id = ?",
+            (CALENDAR_ID,),
+        ) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+
+
+async def apply_sync(
+    upserts: list[dict], deleted_ids: list[str], sync_token: str | None, synced_at: float, full: bool
+) -> None:
+    """Apply one sync round in a single transaction.
+
+    A full sync replaces the whole mirror; an incremental one upserts changed
+    events and removes cancelled ones.
+    """
+    async with get_writer() as db:
+        if full:
+            await db.execute("DELETE FROM calendar_events")
+            max_duration = 0
+        else:
+            max_duration = await _max_duration(db)
+        if deleted_ids:
+            await db.executemany(
+                "DELETE FROM calendar_events WHERE id = ?", [(i,) for i in deleted_ids]
+            )
+        if upserts:
+            await db.executemany(
+                """INSERT OR REPLACE INTO calendar_events
+                   (id, title, start, end, start_ts, end_ts, type, series_id, module_id)
+                   VALUES (:id, :title, :start, :end, :start_ts, :end_ts, :type, :series_id, :module_id)""",
+                upserts,
+            )
+            max_duration = max(max_duration, *(e["end_ts"] - e["start_ts"] for e in upserts))
+        await db.execute(
+            """INSERT OR REPLACE INTO calendar_sync (calendar_id, sync_token, synced_at, max_duration)
+               VALUES (?, ?, ?, ?)""",
+            (CALENDAR_ID, sync_token, synced_at, max_duration),
+        )
+        await db.commit()
+
+
+async def _max_duration(db) -> int:
+    async with db.execute(
+        "SELECT max_duration FROM calendar_sync WHERE calendar_id = ?", (CALENDAR_ID,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        return row["max_duration"] if row else 0
+
+
+async def upsert_events(events: list[dict]) -> None:
+    """Write events straight into the mirror (after we created them)."""
+    async with get_writer() as db:
+        await db.executemany(
+            """INSERT OR REPLACE INTO calendar_events
+               (id, title, start, end, start_ts, end_ts, type, series_id, module_id)
+               VALUES (:id, :title, :start, :end, :start_ts, :end_ts, :type, :series_id, :module_id)""",
+            events,
+        )
+        await db.execute(
+            "UPDATE calendar_sync SET max_duration = max(max_duration, ?) WHERE calendar_id = ?",
+            (max(e["end_ts"] - e["start_ts"] for e in events), CALENDAR_ID),
+        )
+        await db.commit()
+
+
+async def delete_events(event_id: str) -> None:
+    """Remove an event, and every instance if it is a recurring series."""
+    async with get_writer() as db:
+        await db.execute(
+            "DELETE FROM calendar_events WHERE id = ? OR series_id = ?", (event_id, event_id)
+        )
+        await db.commit()
+
+
+async def get_events(start_ts: int, end_ts: int) -> list[dict]:
+    """Events overlapping [start_ts, end_ts), ordered by start."""
+    async with get_db() as db:
+        # The lower bound on start_ts keeps this an index range scan: nothing
+        # starting earlier than the longest event's duration can overlap.
+        async with db.execute(
+            """
+            SELECT id, title, start, end, start_ts, end_ts, type, series_id, module_id
+            FROM calendar_events
+            WHERE start_ts >= ? - coalesce(
+                      (SELECT max_duration FROM calendar_sync WHERE calendar_id = ?), 0)
+              AND start_ts < ?
+              AND end_ts > ?
+            ORDER BY start_ts, id
+            """,
+            (start_ts, CALENDAR_ID, end_ts, start_ts),
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+
+async def get_busy(start_ts: int, end_ts: int) -> list[tuple[int, int]]:
+    """(start_ts, end_ts) of events overlapping [start_ts, end_ts), ordered by start."""
+    async with get_db() as db:
+        async with db.execute(
+            """
+            SELECT start_ts, end_ts FROM calendar_events
+            WHERE start_ts >= ? - coalesce(
+                      (SELECT max_duration FROM calendar_sync WHERE calendar_id = ?), 0)
+              AND start_ts < ?
+              AND end_ts > ?
+            ORDER BY start_ts
+            """,
+            (start_ts, CALENDAR_ID, end_ts, start_ts),
+        ) as cursor:
+            return [(row[0], row[1]) for row in await cursor.fetchall()]
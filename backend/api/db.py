@@ -1,16 +1,221 @@
+import asyncio
+import logging
 import os
 import pathlib
+import time
 import aiosqlite
 from contextlib import asynccontextmanager
 
+from backend import metrics
+
 _default = pathlib.Path(__file__).parent.parent / "data" / "lesson-plan.db"
 DB_PATH = pathlib.Path(os.environ.get("DB_DIR", str(_default.parent))) / "lesson-plan.db"
 
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+# "wal" (default) lets readers proceed while the writer commits; set to
+# "delete" to fall back to SQLite's rollback journal.
+JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "wal").lower()
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+# Connections idle longer than this get a `SELECT 1` before being handed out.
+HEALTH_CHECK_AFTER = 30.0
+
+# Applied to every connection. journal_mode is persistent, so it is only set by
+# the writer; synchronous=NORMAL is durable across app crashes in WAL mode.
+_PRAGMAS = [
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived aiosqlite connections.
+
+    Connections are opened and configured once in `open()`, handed out FIFO by
+    `acquire()`, and closed in `close()`. A connection that fails its health
+    check is replaced transparently.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        size: int,
+        timeout: float,
+        pragmas: list[str],
+        name: str = "pool",
+    ):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.name = name
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._last_used: dict[int, float] = {}
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = True
+
+    async def _connect(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(str(self.path))
+        for pragma in self.pragmas:
+            await db.execute(pragma)
+        db.row_factory = aiosqlite.Row
+        return db
+
+    async def open(self) -> None:
+        if not self._closed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            db = await self._connect()
+            self._last_used[id(db)] = time.monotonic()
+            self._idle.put_nowait(db)
+        self._closed = False
+        log.info("db %s: opened %d connections to %s", self.name, self.size, self.path)
+
+    async def close(self) -> None:
+        """Drain the pool: wait for checked-out connections, then close all."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in range(self.size):
+            try:
+                db = await asyncio.wait_for(self._idle.get(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                log.warning("db %s: gave up waiting for a checked-out connection", self.name)
+                break
+            if db is not None:
+                await db.close()
+        self._last_used.clear()
+        log.info("db %s: closed", self.name)
+
+    async def _checkout(self) -> aiosqlite.Connection:
+        if self._closed:
+            raise RuntimeError("Database pool is not open. Call init_db() first.")
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            # asyncio.timeout, not wait_for: on 3.11 wait_for can swallow a
+            # cancel that arrives as the connection is handed over.
+            async with asyncio.timeout(self.timeout):
+                db = await self._idle.get()
+        except TimeoutError:
+            metrics.incr(f"db.{self.name}.timeouts")
+            raise RuntimeError(f"Timed out after {self.timeout}s waiting for a database connection")
+        finally:
+            self._waiting -= 1
+        metrics.observe(f"db.{self.name}.wait", time.perf_counter() - start)
+
+        if db is not None and time.monotonic() - self._last_used.get(id(db), 0) > HEALTH_CHECK_AFTER:
+            try:
+                await db.execute("SELECT 1")
+            except Exception:
+                log.warning("db %s: replacing unhealthy connection", self.name, exc_info=True)
+                metrics.incr(f"db.{self.name}.reconnects")
+                self._last_used.pop(id(db), None)
+                try:
+                    await db.close()
+                except Exception:
+                    pass
+                db = None
+        if db is None:
+            # Empty slot (a previous reconnect failed); keep the pool at full size.
+            try:
+                db = await self._connect()
+            except Exception:
+                self._idle.put_nowait(None)
+                raise
+        return db
+
+    async def _checkin(self, db: aiosqlite.Connection) -> None:
+        if db.in_transaction:
+            # The borrower raised before committing; don't leak its writes.
+            try:
+                await db.rollback()
+            except Exception:
+                log.warning("db %s: rollback failed, dropping connection", self.name, exc_info=True)
+                self._last_used.pop(id(db), None)
+                try:
+                    await db.close()
+                except Exception:
+                    pass
+                self._idle.put_nowait(None)
+                return
+        self._last_used[id(db)] = time.monotonic()
+        self._idle.put_nowait(db)
+
+    @asynccontextmanager
+    async def acquire(self):
+        db = await self._checkout()
+        self._in_use += 1
+        start = time.perf_counter()
+        try:
+            yield db
+        finally:
+            self._in_use -= 1
+            metrics.observe(f"db.{self.name}.checkout", time.perf_counter() - start)
+            await self._checkin(db)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "open": not self._closed,
+        }
+
+
+# One serialized writer: a size-1 pool is a FIFO queue of writers, so all three
+# stores commit in arrival order instead of racing for SQLite's write lock.
+_writer = ConnectionPool(
+    DB_PATH,
+    1,
+    POOL_TIMEOUT,
+    [f"PRAGMA journal_mode = {JOURNAL_MODE}", *_PRAGMAS],
+    name="writer",
+)
+# Readers never take the write lock; under WAL they read the last committed
+# snapshot while the writer is mid-transaction.
+_readers = ConnectionPool(
+    DB_PATH,
+    POOL_SIZE,
+    POOL_TIMEOUT,
+    [*_PRAGMAS, "PRAGMA query_only = ON"],
+    name="readers",
+)
+
+
+async def init_db() -> None:
+    # Writer first: it creates the file and switches it to WAL.
+    await _writer.open()
+    await _readers.open()
+
+
+async def close_db() -> None:
+    await _readers.close()
+    await _writer.close()
+
+
+def pool_stats() -> dict:
+    return {"writer": _writer.stats(), "readers": _readers.stats()}
+
 
 @asynccontextmanager
 async def get_db():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(str(DB_PATH)) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        db.row_factory = aiosqlite.Row
+    """Check out a read-only connection."""
+    async with _readers.acquire() as db:
+        yield db
+
+
+@asynccontextmanager
+async def get_writer():
+    """Check out the single writer connection. Callers must commit."""
+    async with _writer.acquire() as db:
         yield db
@@ -1,10 +1,24 @@
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from backend import metrics
+from backend.api import calendar_store
+
+log = logging.getLogger(__name__)
 
 BACKEND_DIR = Path(__file__).parent.parent
 TOKEN_FILE = BACKEND_DIR / "token.json"
@@ -13,116 +27,285 @@ SCOPES = ["https://www.googleapis.com/auth/calendar"]
 # 0=Mon … 6=Sun  →  RRULE BYDAY tokens
 _RRULE_DAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
 
-# Module-level cache so we don't rebuild the service on every request
-_service = None
+# googleapiclient is blocking (httplib2), so every call runs on this bounded
+# pool instead of the event loop.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("CALENDAR_WORKERS", "4")),
+    thread_name_prefix="gcal",
+)
+# Refresh access tokens this long before they expire
+_REFRESH_MARGIN = timedelta(minutes=5)
+# Reads within this many seconds of the last sync are served from the mirror
+# without asking Google for changes.
+SYNC_INTERVAL = float(os.environ.get("CALENDAR_SYNC_INTERVAL", "60"))
+# Google caps a Calendar batch request at 50 calls.
+BATCH_SIZE = 50
+FREEBUSY_SPAN = 60 * 24 * 3600
+
+# Credentials are loaded once and refreshed in place; `_generation` is bumped
+# whenever they are replaced so per-thread services get rebuilt.
+_creds: Credentials | None = None
+_generation = 0
+_refresh_lock: asyncio.Lock | None = None
 _timezone: str | None = None
+# httplib2 connections aren't thread-safe: one service object per pool thread
+_local = threading.local()
+_sync_lock: asyncio.Lock | None = None
+# Set when the account may have changed; the next sync starts from scratch.
+_resync = True
+# Bumped by our own writes so the next read picks them up straight away.
+_writes = 0
+_synced_writes = 0
 
 
 def is_authenticated() -> bool:
     return TOKEN_FILE.exists()
 
 
+def reload_credentials() -> None:
+    """Forget cached credentials, e.g. after a new token.json was written."""
+    global _creds, _generation, _timezone, _resync
+    _creds = None
+    _generation += 1
+    _timezone = None
+    _resync = True
+
+
 def clear_token() -> None:
-    global _service, _timezone
     if TOKEN_FILE.exists():
         TOKEN_FILE.unlink()
-    _service = None
-    _timezone = None
+    reload_credentials()
+
+
+async def _run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth keeps expiry as naive UTC
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < _REFRESH_MARGIN
+
+
+def _refresh_and_save(creds: Credentials) -> None:
+    creds.refresh(Request())
+    TOKEN_FILE.write_text(creds.to_json())
+
+
+async def _credentials() -> Credentials:
+    global _creds, _refresh_lock
+    if _creds is None:
+        if not TOKEN_FILE.exists():
+            raise RuntimeError("Not authenticated. Visit /oauth/start.")
+        _creds = await _run(Credentials.from_authorized_user_file, str(TOKEN_FILE), SCOPES)
+    creds = _creds
+    if _needs_refresh(creds) and creds.refresh_token:
+        if _refresh_lock is None:
+            _refresh_lock = asyncio.Lock()
+        # Single flight: the first caller refreshes, the rest wait and reuse it.
+        async with _refresh_lock:
+            if _needs_refresh(creds):
+                await _run(_refresh_and_save, creds)
+    return creds
+
+
+def _thread_service(creds: Credentials, generation: int):
+    """Calendar service for the current pool thread (runs in the executor)."""
+    if getattr(_local, "generation", None) != generation:
+        _local.service = build("calendar", "v3", credentials=creds, cache_discovery=False)
+        _local.generation = generation
+    return _local.service
+
 
+async def _execute(make_request):
+    """Run `make_request(service).execute()` on the executor with fresh credentials."""
+    creds = await _credentials()
+    generation = _generation
 
-def get_service():
-    global _service, _timezone
-    if not TOKEN_FILE.exists():
-        raise RuntimeError("Not authenticated. Visit /oauth/start.")
-    creds = Credentials.from_authorized_user_file(str(TOKEN_FILE), SCOPES)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-        TOKEN_FILE.write_text(creds.to_json())
-        # Rebuild service and clear timezone cache so they use the refreshed credentials
-        _service = None
-        _timezone = None
-    if _service is None:
-        _service = build("calendar", "v3", credentials=creds)
-    return _service
+    def call():
+        return make_request(_thread_service(creds, generation)).execute()
 
+    return await _run(call)
 
-def get_timezone() -> str:
+
+async def get_timezone() -> str:
     global _timezone
     if _timezone is None:
-        cal = get_service().calendars().get(calendarId="primary").execute()
+        cal = await _execute(lambda svc: svc.calendars().get(calendarId="primary"))
         _timezone = cal.get("timeZone", "UTC")
     return _timezone
 
 
-def get_events(start: str, end: str) -> list[dict]:
-    result = (
-        get_service()
-        .events()
-        .list(
-            calendarId="primary",
-            timeMin=start,
-            timeMax=end,
-            singleEvents=True,
-            orderBy="startTime",
-        )
-        .execute()
-    )
+def epoch(value: str) -> int:
+    """RFC 3339 / ISO 8601 string to UTC epoch seconds (naive means UTC)."""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _to_row(item: dict) -> dict | None:
+    """Mirror row for an API event, or None if it shouldn't be mirrored."""
+    start_obj = item.get("start", {})
+    end_obj = item.get("end", {})
+
+    # Skip all-day events (date-only, no time component)
+    if item.get("status") == "cancelled" or "dateTime" not in start_obj:
+        return None
+
+    ext = item.get("extendedProperties", {}).get("private", {})
+    bayard_type = ext.get("bayard_type")  # "module" | "habit" | None
+
+    return {
+        "id": item["id"],
+        "title": item.get("summary", "(no title)"),
+        "start": start_obj["dateTime"],
+        "end": end_obj["dateTime"],
+        "start_ts": epoch(start_obj["dateTime"]),
+        "end_ts": epoch(end_obj["dateTime"]),
+        "type": bayard_type or "external",
+        "series_id": item.get("recurringEventId"),
+        "module_id": int(ext["module_id"]) if ext.get("module_id") else None,
+    }
 
-    events = []
-    for item in result.get("items", []):
-        start_obj = item.get("start", {})
-        end_obj = item.get("end", {})
-
-        # Skip all-day events (date-only, no time component)
-        if "dateTime" not in start_obj:
-            continue
-
-        ext = item.get("extendedProperties", {}).get("private", {})
-        bayard_type = ext.get("bayard_type")  # "module" | "habit" | None
-
-        events.append(
-            {
-                "id": item["id"],
-                "title": item.get("summary", "(no title)"),
-                "start": start_obj["dateTime"],
-                "end": end_obj["dateTime"],
-                "type": bayard_type or "external",
-                "series_id": item.get("recurringEventId"),
-                "module_id": int(ext["module_id"]) if ext.get("module_id") else None,
-            }
+
+async def _list_changes(sync_token: str | None) -> tuple[list[dict], str]:
+    """Every event changed since `sync_token` (all events if None), across pages."""
+    items: list[dict] = []
+    page_token = None
+    while True:
+        params = {"calendarId": "primary", "singleEvents": True, "maxResults": 2500}
+        if sync_token:
+            params["syncToken"] = sync_token
+        if page_token:
+            params["pageToken"] = page_token
+        result = await _execute(lambda svc: svc.events().list(**params))
+        items.extend(result.get("items", []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return items, result["nextSyncToken"]
+
+
+async def sync_events(force: bool = False) -> None:
+    """Bring the local mirror up to date with Google.
+
+    Uses the stored sync token for a delta sync; falls back to a full sync on
+    first use, after re-authentication, or when Google expires the token
+    (410 Gone). Concurrent callers share one sync.
+    """
+    global _sync_lock, _resync, _synced_writes
+    if _sync_lock is None:
+        _sync_lock = asyncio.Lock()
+    async with _sync_lock:
+        state = await calendar_store.get_sync_state()
+        fresh = state and time.time() - state["synced_at"] < SYNC_INTERVAL
+        if fresh and not (force or _resync or _writes != _synced_writes):
+            return
+
+        token = state["sync_token"] if state and not _resync else None
+        writes = _writes
+        with metrics.timed("calendar.sync"):
+            try:
+                items, next_token = await _list_changes(token)
+            except HttpError as e:
+                if token is None or e.resp.status != 410:
+                    raise
+                log.info("calendar: sync token expired, running a full sync")
+                metrics.incr("calendar.sync.token_expired")
+                token = None
+                items, next_token = await _list_changes(None)
+
+        upserts, deleted = [], []
+        for item in items:
+            row = _to_row(item)
+            if row is None:
+                deleted.append(item["id"])
+            else:
+                upserts.append(row)
+        await calendar_store.apply_sync(
+            upserts, deleted, next_token, time.time(), full=token is None
         )
-    return events
+        metrics.incr("calendar.sync.full" if token is None else "calendar.sync.delta")
+        metrics.incr("calendar.sync.changes", len(items))
+        _resync = False
+        # A write that landed while we were listing still counts as unsynced.
+        _synced_writes = writes
+
+
+async def get_busy(start: int, end: int) -> list[tuple[int, int]]:
+    """Busy (start, end) epoch intervals from the freebusy endpoint, unmerged."""
+    busy = []
+    # freebusy rejects very long ranges; query them in spans.
+    for span_start in range(start, end, FREEBUSY_SPAN):
+        span_end = min(span_start + FREEBUSY_SPAN, end)
+        body = {
+            "timeMin": datetime.fromtimestamp(span_start, timezone.utc).isoformat(),
+            "timeMax": datetime.fromtimestamp(span_end, timezone.utc).isoformat(),
+            "items": [{"id": "primary"}],
+        }
+        result = await _execute(lambda svc: svc.freebusy().query(body=body))
+        for period in result["calendars"]["primary"].get("busy", []):
+            busy.append((epoch(period["start"]), epoch(period["end"])))
+    return busy
+
 
+def _is_auth_error(e: Exception) -> bool:
+    if isinstance(e, RefreshError) or "invalid_grant" in str(e):
+        return True
+    return isinstance(e, HttpError) and e.resp.status in (401, 403)
 
-def _localize(naive_str: str) -> datetime:
+
+async def get_events(start: str, end: str) -> list[dict]:
+    """Events overlapping [start, end), read from the mirror after a sync.
+
+    If the sync fails for a reason other than auth, the mirror is served as it
+    stands rather than failing the read. Without a usable mirror (never
+    synced, or credentials changed since) the error propagates.
+    """
+    try:
+        await sync_events()
+    except Exception as e:
+        if _is_auth_error(e) or _resync or await calendar_store.get_sync_state() is None:
+            raise
+        log.warning("calendar: sync failed, serving the local mirror: %s", e)
+        metrics.incr("calendar.sync.failed")
+    rows = await calendar_store.get_events(epoch(start), epoch(end))
+    for row in rows:
+        del row["start_ts"], row["end_ts"]
+    return rows
+
+
+def _mark_stale() -> None:
+    """Our write changed the calendar; sync before the next read."""
+    global _writes
+    _writes += 1
+
+
+def _localize(naive_str: str, tz: str) -> datetime:
     """Parse a naive datetime string and attach the calendar's local timezone."""
     dt = datetime.fromisoformat(naive_str)
-    return dt.replace(tzinfo=ZoneInfo(get_timezone()))
-
+    return dt.replace(tzinfo=ZoneInfo(tz))
 
-def create_module_block(module_id: int, title: str, start: str, end: str) -> str:
-    """Create a one-off Google Calendar event for a module block. Returns event id."""
-    tz = get_timezone()
-    start_dt = _localize(start)
-    end_dt = _localize(end)
 
-    event = {
+def _module_block_event(module_id: int, title: str, start: str, end: str, tz: str) -> dict:
+    return {
         "summary": title,
-        "start": {"dateTime": start_dt.isoformat(), "timeZone": tz},
-        "end": {"dateTime": end_dt.isoformat(), "timeZone": tz},
+        "start": {"dateTime": _localize(start, tz).isoformat(), "timeZone": tz},
+        "end": {"dateTime": _localize(end, tz).isoformat(), "timeZone": tz},
         "extendedProperties": {
             "private": {"bayard_type": "module", "module_id": str(module_id)}
         },
     }
-    created = get_service().events().insert(calendarId="primary", body=event).execute()
-    return created["id"]
 
 
-def create_habit(
-    title: str, days_of_week: list[int], start_time: str, duration_minutes: int
-) -> str:
-    """Create a recurring weekly Google Calendar event for a habit. Returns event id."""
-    tz_str = get_timezone()
+def _habit_event(
+    title: str, days_of_week: list[int], start_time: str, duration_minutes: int, tz_str: str
+) -> dict:
     tz = ZoneInfo(tz_str)
     h, m = map(int, start_time.split(":"))
 
@@ -142,16 +325,107 @@ def create_habit(
     end_dt = start_dt + timedelta(minutes=duration_minutes)
     byday = ",".join(_RRULE_DAYS[d] for d in sorted(days_of_week))
 
-    event = {
+    return {
         "summary": title,
         "start": {"dateTime": start_dt.isoformat(), "timeZone": tz_str},
         "end": {"dateTime": end_dt.isoformat(), "timeZone": tz_str},
         "recurrence": [f"RRULE:FREQ=WEEKLY;BYDAY={byday}"],
         "extendedProperties": {"private": {"bayard_type": "habit"}},
     }
-    created = get_service().events().insert(calendarId="primary", body=event).execute()
+
+
+async def create_module_block(module_id: int, title: str, start: str, end: str) -> str:
+    """Create a one-off Google Calendar event for a module block. Returns event id."""
+    event = _module_block_event(module_id, title, start, end, await get_timezone())
+    created = await _execute(lambda svc: svc.events().insert(calendarId="primary", body=event))
+    row = _to_row(created)
+    if row is not None:
+        await calendar_store.upsert_events([row])
     return created["id"]
 
 
-def delete_event(event_id: str) -> None:
-    get_service().events().delete(calendarId="primary", eventId=event_id).execute()
+async def create_habit(
+    title: str, days_of_week: list[int], start_time: str, duration_minutes: int
+) -> str:
+    """Create a recurring weekly Google Calendar event for a habit. Returns event id."""
+    event = _habit_event(title, days_of_week, start_time, duration_minutes, await get_timezone())
+    created = await _execute(lambda svc: svc.events().insert(calendarId="primary", body=event))
+    _mark_stale()
+    return created["id"]
+
+
+def _insert_batch(svc, events: list[dict], results: list):
+    """One batch HTTP request inserting `events`; fills `results` in order."""
+
+    def collect(request_id, response, exception):
+        i = int(request_id)
+        results[i] = (response, exception)
+
+    batch = svc.new_batch_http_request(callback=collect)
+    for i, event in enumerate(events):
+        batch.add(svc.events().insert(calendarId="primary", body=event), request_id=str(i))
+    return batch
+
+
+async def insert_events(events: list[dict]) -> list[dict]:
+    """Insert many events through Google's batch endpoint, BATCH_SIZE per round trip.
+
+    Returns one result per event, in order: {"ok": True, "id": ...} or
+    {"ok": False, "error": ...}. A failed item doesn't fail the others.
+    """
+    results: list[dict] = []
+    rows = []
+    for offset in range(0, len(events), BATCH_SIZE):
+        chunk = events[offset:offset + BATCH_SIZE]
+        responses: list = [(None, None)] * len(chunk)
+        try:
+            await _execute(lambda svc: _insert_batch(svc, chunk, responses))
+        except Exception as e:
+            # The whole round trip failed; report it on every item in it.
+            responses = [(None, e)] * len(chunk)
+        for response, exception in responses:
+            if exception is not None or response is None:
+                results.append({"ok": False, "error": str(exception or "No response")})
+                continue
+            results.append({"ok": True, "id": response["id"]})
+            row = _to_row(response)
+            if row is not None:
+                rows.append(row)
+
+    metrics.incr("calendar.batch.inserted", sum(r["ok"] for r in results))
+    metrics.incr("calendar.batch.failed", sum(not r["ok"] for r in results))
+    if rows:
+        await calendar_store.upsert_events(rows)
+    if any("recurrence" in e for e in events):
+        # Recurring instances only show up through a sync.
+        _mark_stale()
+    return results
+
+
+async def create_module_blocks(blocks: list[dict]) -> list[dict]:
+    """Create many module blocks ({module_id, title, start, end}) in batches."""
+    if not blocks:
+        return []
+    tz = await get_timezone()
+    return await insert_events(
+        [_module_block_event(b["module_id"], b["title"], b["start"], b["end"], tz) for b in blocks]
+    )
+
+
+async def create_habits(habits: list[dict]) -> list[dict]:
+    """Create many habits ({title, days_of_week, start_time, duration_minutes}) in batches."""
+    if not habits:
+        return []
+    tz = await get_timezone()
+    return await insert_events(
+        [
+            _habit_event(h["title"], h["days_of_week"], h["start_time"], h["duration_minutes"], tz)
+            for h in habits
+        ]
+    )
+
+
+async def delete_event(event_id: str) -> None:
+    await _execute(lambda svc: svc.events().delete(calendarId="primary", eventId=event_id))
+    await calendar_store.delete_events(event_id)
+    _mark_stale()
@@ -1,55 +1,72 @@
-import aiosqlite
-from backend.api.db import get_db
+import json
 
+from backend.api.artifact_store import score_artifact
+from backend.api.db import get_db, get_writer
+from backend.api.module_store import insert_modules
 
-async def create_table() -> None:
-    async with get_db() as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS lesson_plans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                plan TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'active',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )"""
-        )
-        # Migrate existing DBs that don't have the status column yet
-        try:
-            await db.execute("ALTER TABLE lesson_plans ADD COLUMN status TEXT NOT NULL DEFAULT 'active'")
-        except aiosqlite.OperationalError:
-            pass  # column already exists
-        await db.commit()
+# Bumped on every plan insert/delete/status change so in-memory views of the
+# plan list (e.g. the analyze_lesson tool schema) know when to rebuild.
+# Per-process: other workers' writes are not observed.
+_version = 0
+
+
+def plans_version() -> int:
+    return _version
+
+
+def _bump_version() -> None:
+    global _version
+    _version += 1
 
 
 async def set_plan(title: str, plan: str) -> int:
     """Insert a lesson plan and return its new id."""
-    async with get_db() as db:
+    async with get_writer() as db:
         cursor = await db.execute(
             "INSERT INTO lesson_plans (title, plan) VALUES (?, ?)",
             (title, plan),
         )
         await db.commit()
-        return cursor.lastrowid
+    _bump_version()
+    return cursor.lastrowid
+
+
+async def create_plan(title: str, plan: str, modules: list[dict]) -> tuple[int, list[dict]]:
+    """Insert a lesson plan and its modules in one transaction.
+
+    Returns the new plan id and the saved module rows (with their ids).
+    """
+    async with get_writer() as db:
+        cursor = await db.execute(
+            "INSERT INTO lesson_plans (title, plan) VALUES (?, ?)",
+            (title, plan),
+        )
+        plan_id = cursor.lastrowid
+        saved = await insert_modules(db, plan_id, modules)
+        await db.commit()
+    _bump_version()
+    return plan_id, saved
 
 
 async def update_plan_status(plan_id: int, status: str) -> None:
     """Update the status of a lesson plan. Valid values: 'active', 'completed'."""
     if status not in ("active", "completed"):
         raise ValueError(f"Invalid status: {status!r}")
-    async with get_db() as db:
+    async with get_writer() as db:
         await db.execute(
             "UPDATE lesson_plans SET status = ? WHERE id = ?",
             (status, plan_id),
         )
         await db.commit()
+    _bump_version()
 
 
 async def delete_plan(plan_id: int) -> None:
     """Delete a lesson plan by id. Foreign key cascade removes associated modules."""
-    async with get_db() as db:
+    async with get_writer() as db:
         await db.execute("DELETE FROM lesson_plans WHERE id = ?", (plan_id,))
         await db.commit()
+    _bump_version()
 
 
 async def get_plan(plan_id: int) -> dict | None:
@@ -79,3 +96,68 @@ async def get_plans() -> list[dict]:
         ) as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
+
+
+async def get_plan_report(plan_id: int) -> dict | None:
+    """Return a plan with its modules and their artifacts in a single query.
+
+    Each module carries its decoded `artifacts`, each artifact its `score`
+    (quizzes and checklists only), and each module a `scores` summary keyed by
+    artifact type, e.g. {"quiz": {"done": 3, "total": 5}}.
+    """
+    async with get_db() as db:
+        async with db.execute(
+            """
+            SELECT lp.id AS plan_id, lp.title, lp.plan, lp.status AS plan_status,
+                   lp.created_at AS plan_created_at,
+                   m.id, m.position, m.name, m.description, m.type, m.status,
+                   json_group_array(
+                       json_object('id', a.id, 'type', a.type, 'data', json(a.data))
+                   ) FILTER (WHERE a.id IS NOT NULL) AS artifacts
+            FROM lesson_plans lp
+            LEFT JOIN modules m ON m.plan_id = lp.id
+            LEFT JOIN artifacts a ON a.module_id = m.id
+            WHERE lp.id = ?
+            GROUP BY m.id
+            ORDER BY m.position
+            """,
+            (plan_id,),
+        ) as cursor:
+            rows = await cursor.fetchall()
+    if not rows:
+        return None
+
+    first = rows[0]
+    report = {
+        "id": first["plan_id"],
+        "title": first["title"],
+        "plan": first["plan"],
+        "status": first["plan_status"],
+        "created_at": first["plan_created_at"],
+        "modules": [],
+    }
+    for row in rows:
+        if row["id"] is None:
+            continue  # plan has no modules
+        artifacts = sorted(json.loads(row["artifacts"]), key=lambda a: a["id"])
+        scores: dict[str, dict] = {}
+        for a in artifacts:
+            a["score"] = score_artifact(a)
+            if a["score"]:
+                total = scores.setdefault(a["type"], {"done": 0, "total": 0})
+                total["done"] += a["score"]["done"]
+                total["total"] += a["score"]["total"]
+        report["modules"].append(
+            {
+                "id": row["id"],
+                "plan_id": first["plan_id"],
+                "position": row["position"],
+                "name": row["name"],
+                "description": row["description"],
+                "type": row["type"],
+                "status": row["status"],
+                "artifacts": artifacts,
+                "scores": scores,
+            }
+        )
+    return report
@@ -0,0 +1,58 @@
+import json
+import time
+
+from backend.api.db import get_db, get_writer
+
+# Responses of forced tool calls, keyed by a hash of the request (see
+# agents.base.forced_tool_call). Rows expire after a TTL and the least
+# recently used ones are evicted once the table outgrows its byte budget.
+
+# A hit only rewrites last_used when it is older than this, so repeated hits
+# stay off the single writer; LRU order is kept to this granularity.
+TOUCH_INTERVAL = 60.0
+
+
+async def get_response(key: str, ttl: float) -> dict | None:
+    """Return the cached tool input for `key` if it is younger than `ttl` seconds."""
+    async with get_db() as db:
+        async with db.execute(
+            "SELECT response, last_used FROM llm_cache WHERE key = ? AND created_at >= ?",
+            (key, time.time() - ttl),
+        ) as cursor:
+            row = await cursor.fetchone()
+    if row is None:
+        return None
+    now = time.time()
+    if now - row["last_used"] > TOUCH_INTERVAL:
+        async with get_writer() as db:
+            await db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            await db.commit()
+    return json.loads(row["response"])
+
+
+async def put_response(key: str, tool: str, response: dict, ttl: float, max_bytes: int) -> int:
+    """Store a response, then drop expired rows and LRU rows beyond `max_bytes`.
+
+    Returns the number of rows evicted.
+    """
+    data = json.dumps(response)
+    now = time.time()
+    async with get_writer() as db:
+        await db.execute(
+            """INSERT OR REPLACE INTO llm_cache (key, tool, response, size, created_at, last_used)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (key, tool, data, len(data), now, now),
+        )
+        expired = await db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - ttl,))
+        # Keep the most recently used rows whose running size fits the budget.
+        evicted = await db.execute(
+            """DELETE FROM llm_cache WHERE key IN (
+                   SELECT key FROM (
+                       SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running
+                       FROM llm_cache
+                   ) WHERE running > ?
+               )""",
+            (max_bytes,),
+        )
+        await db.commit()
+        return expired.rowcount + evicted.rowcount
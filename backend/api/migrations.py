@@ -0,0 +1,214 @@
+"""Versioned schema migrations for lesson-plan.db.
+
+Each migration is an async function that receives the writer connection and
+runs inside a transaction. Applied versions are recorded in
+`schema_migrations`; `run_migrations()` runs once at startup and applies only
+the ones that are missing, in order. Append new migrations — never edit or
+renumber one that has shipped.
+"""
+
+import logging
+
+import aiosqlite
+
+from backend.api.db import get_writer
+
+log = logging.getLogger(__name__)
+
+
+async def _columns(db: aiosqlite.Connection, table: str) -> set[str]:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+async def _m001_baseline(db: aiosqlite.Connection) -> None:
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lesson_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    # Databases created before plan status existed
+    if "status" not in await _columns(db, "lesson_plans"):
+        await db.execute(
+            "ALTER TABLE lesson_plans ADD COLUMN status TEXT NOT NULL DEFAULT 'active'"
+        )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS modules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id INTEGER NOT NULL REFERENCES lesson_plans(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            type TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'locked',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS artifacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            module_id INTEGER NOT NULL REFERENCES modules(id) ON DELETE CASCADE,
+            type TEXT NOT NULL,
+            data TEXT NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+
+
+async def _m002_lookup_indexes(db: aiosqlite.Connection) -> None:
+    # Also serve the ON DELETE CASCADE lookups from lesson_plans and modules.
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_modules_plan_position ON modules(plan_id, position)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_artifacts_module ON artifacts(module_id, id)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_lesson_plans_created ON lesson_plans(created_at)"
+    )
+
+
+async def _m003_calendar_mirror(db: aiosqlite.Connection) -> None:
+    # Times as UTC epoch seconds for range queries; start/end keep Google's
+    # RFC 3339 strings (with the event's offset) for the API response.
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS calendar_events (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            start TEXT NOT NULL,
+            end TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            series_id TEXT,
+            module_id INTEGER
+        )"""
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calendar_events_start ON calendar_events(start_ts)"
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS calendar_sync (
+            calendar_id TEXT PRIMARY KEY,
+            sync_token TEXT,
+            synced_at REAL NOT NULL,
+            max_duration INTEGER NOT NULL DEFAULT 0
+        )"""
+    )
+
+
+async def _m004_llm_cache(db: aiosqlite.Connection) -> None:
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            tool TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )"""
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)"
+    )
+
+
+async def _m005_artifact_status(db: aiosqlite.Connection) -> None:
+    # 'generating' while one worker holds the artifact's generation claim.
+    columns = await _columns(db, "artifacts")
+    if "status" not in columns:
+        await db.execute(
+            "ALTER TABLE artifacts ADD COLUMN status TEXT NOT NULL DEFAULT 'idle'"
+        )
+    if "generating_since" not in columns:
+        await db.execute("ALTER TABLE artifacts ADD COLUMN generating_since REAL")
+
+
+async def _m006_jobs(db: aiosqlite.Connection) -> None:
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            result TEXT,
+            total INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            errors TEXT NOT NULL DEFAULT '[]',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            lease_until REAL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )"""
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)"
+    )
+
+
+MIGRATIONS = [
+    (1, "baseline", _m001_baseline),
+    (2, "lookup_indexes", _m002_lookup_indexes),
+    (3, "calendar_mirror", _m003_calendar_mirror),
+    (4, "llm_cache", _m004_llm_cache),
+    (5, "artifact_status", _m005_artifact_status),
+    (6, "jobs", _m006_jobs),
+]
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> list[int]:
+    """Apply pending migrations on `db`. Returns the versions applied."""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    await db.commit()
+
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        # IMMEDIATE takes the write lock up front, so a second worker starting
+        # at the same time waits here and then sees the version as applied.
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            async with db.execute(
+                "SELECT 1 FROM schema_migrations WHERE version = ?", (version,)
+            ) as cursor:
+                if await cursor.fetchone():
+                    await db.rollback()
+                    continue
+            log.info("migrations: applying %03d_%s", version, name)
+            await migrate(db)
+            await db.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+                (version, name),
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+async def run_migrations() -> None:
+    async with get_writer() as db:
+        applied = await apply_migrations(db)
+    if applied:
+        log.info("migrations: schema now at version %d", applied[-1])
@@ -1,40 +1,38 @@
-from backend.api.db import get_db
-
-
-async def create_table() -> None:
-    async with get_db() as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS modules (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                plan_id INTEGER NOT NULL REFERENCES lesson_plans(id) ON DELETE CASCADE,
-                position INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                description TEXT NOT NULL,
-                type TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'locked',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )"""
-        )
-        await db.commit()
-
-
-async def save_modules(plan_id: int, modules: list[dict]) -> None:
-    """Bulk insert modules for a plan. First module starts active; rest locked."""
-    async with get_db() as db:
-        for i, m in enumerate(modules):
-            status = "active" if i == 0 else "locked"
-            await db.execute(
-                """INSERT INTO modules (plan_id, position, name, description, type, status)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (plan_id, i + 1, m["name"], m["description"], m["type"], status),
-            )
+from backend.api.db import get_db, get_writer
+
+
+async def insert_modules(db, plan_id: int, modules: list[dict]) -> list[dict]:
+    """Insert modules in one statement on an open writer connection (no commit).
+
+    First module starts active; rest locked. Returns the new rows by position.
+    """
+    if not modules:
+        return []
+    params = []
+    for i, m in enumerate(modules):
+        status = "active" if i == 0 else "locked"
+        params += [plan_id, i + 1, m["name"], m["description"], m["type"], status]
+    values = ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(modules))
+    async with db.execute(
+        f"""INSERT INTO modules (plan_id, position, name, description, type, status)
+            VALUES {values} RETURNING *""",
+        params,
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return sorted((dict(row) for row in rows), key=lambda m: m["position"])
+
+
+async def save_modules(plan_id: int, modules: list[dict]) -> list[dict]:
+    """Bulk insert modules for a plan and return the saved rows."""
+    async with get_writer() as db:
+        saved = await insert_modules(db, plan_id, modules)
         await db.commit()
+        return saved
 
 
 async def complete_module(module_id: int) -> None:
     """Mark a module completed and unlock the next one in sequence."""
-    async with get_db() as db:
+    async with get_writer() as db:
         async with db.execute(
             "SELECT plan_id, position FROM modules WHERE id = ?", (module_id,)
         ) as cursor:
@@ -73,6 +71,18 @@ async def get_module(module_id: int) -> dict | None:
             return dict(row)
 
 
+async def get_modules_by_id(module_ids: list[int]) -> dict[int, dict]:
+    """Return the given modules in one query, keyed by id; missing ids are absent."""
+    ids = list(dict.fromkeys(module_ids))
+    if not ids:
+        return {}
+    marks = ", ".join("?" * len(ids))
+    async with get_db() as db:
+        async with db.execute(f"SELECT * FROM modules WHERE id IN ({marks})", ids) as cursor:
+            rows = await cursor.fetchall()
+    return {row["id"]: dict(row) for row in rows}
+
+
 async def update_module(module_id: int, fields: dict) -> None:
     """Partial update — only name, description, type, status are writable."""
     allowed = {"name", "description", "type", "status"}
@@ -81,13 +91,13 @@ async def update_module(module_id: int, fields: dict) -> None:
         return
     set_clause = ", ".join(f"{k} = ?" for k in updates)
     values = list(updates.values()) + [module_id]
-    async with get_db() as db:
+    async with get_writer() as db:
         await db.execute(f"UPDATE modules SET {set_clause} WHERE id = ?", values)
         await db.commit()
 
 
 async def delete_module(module_id: int) -> None:
-    async with get_db() as db:
+    async with get_writer() as db:
         await db.execute("DELETE FROM modules WHERE id = ?", (module_id,))
         await db.commit()
 
@@ -0,0 +1,191 @@
+"""Place module blocks into free time, using the local calendar mirror."""
+
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from backend.api import calendar_store, google_calendar
+from backend.api.module_store import get_modules
+
+
+def merge_busy(busy: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Sort and merge overlapping or touching (start, end) intervals."""
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(busy):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def working_windows(
+    start: int,
+    end: int,
+    tz: ZoneInfo,
+    day_start: str = "09:00",
+    day_end: str = "17:00",
+    weekdays: list[int] | None = None,
+) -> list[tuple[int, int]]:
+    """Working-hours intervals in [start, end), one per day, in calendar time.
+
+    Day boundaries are taken in `tz`, so DST shifts move the epoch times, not
+    the wall-clock hours. `weekdays` uses 0=Mon … 6=Sun (default: every day).
+    """
+    open_at = time.fromisoformat(day_start)
+    close_at = time.fromisoformat(day_end)
+    windows = []
+    day = datetime.fromtimestamp(start, tz).date()
+    last = datetime.fromtimestamp(end, tz).date()
+    while day <= last:
+        if weekdays is None or day.weekday() in weekdays:
+            w_start = max(int(datetime.combine(day, open_at, tz).timestamp()), start)
+            w_end = min(int(datetime.combine(day, close_at, tz).timestamp()), end)
+            if w_start < w_end:
+                windows.append((w_start, w_end))
+        day += timedelta(days=1)
+    return windows
+
+
+def free_slots(
+    busy: list[tuple[int, int]], windows: list[tuple[int, int]], duration: int
+) -> list[tuple[int, int]]:
+    """Free gaps of at least `duration` seconds inside `windows`.
+
+    Both inputs must be sorted; `busy` merged (see merge_busy). One sweep over
+    the two lists, so O(busy + windows) however long the range is.
+    """
+    slots = []
+    i = 0
+    for w_start, w_end in windows:
+        # Busy intervals ending before this window can't affect later ones either.
+        while i < len(busy) and busy[i][1] <= w_start:
+            i += 1
+        cursor = w_start
+        j = i
+        while j < len(busy) and busy[j][0] < w_end:
+            b_start, b_end = busy[j]
+            if b_start - cursor >= duration:
+                slots.append((cursor, b_start))
+            cursor = max(cursor, b_end)
+            j += 1
+        if w_end - cursor >= duration:
+            slots.append((cursor, w_end))
+    return slots
+
+
+async def get_busy(start: int, end: int, source: str = "cache") -> list[tuple[int, int]]:
+    """Merged busy intervals from the local mirror or Google's freebusy endpoint."""
+    if source == "freebusy":
+        busy = await google_calendar.get_busy(start, end)
+    else:
+        await google_calendar.sync_events()
+        busy = await calendar_store.get_busy(start, end)
+    return merge_busy(busy)
+
+
+async def find_slots(
+    start: str,
+    end: str,
+    duration_minutes: int = 60,
+    day_start: str = "09:00",
+    day_end: str = "17:00",
+    weekdays: list[int] | None = None,
+    source: str = "cache",
+    limit: int | None = None,
+) -> list[dict]:
+    """Free slots between two RFC 3339 instants, in the calendar's timezone.
+
+    Each slot is a maximal free gap {start, end} of at least `duration_minutes`
+    within working hours; the caller picks where in it to book.
+    """
+    tz = ZoneInfo(await google_calendar.get_timezone())
+    start_ts = google_calendar.epoch(start)
+    end_ts = google_calendar.epoch(end)
+    busy = await get_busy(start_ts, end_ts, source)
+    windows = working_windows(start_ts, end_ts, tz, day_start, day_end, weekdays)
+    slots = free_slots(busy, windows, duration_minutes * 60)
+    if limit is not None:
+        slots = slots[:limit]
+    return [
+        {
+            "start": datetime.fromtimestamp(s, tz).isoformat(),
+            "end": datetime.fromtimestamp(e, tz).isoformat(),
+        }
+        for s, e in slots
+    ]
+
+
+def _local(ts: int, tz: ZoneInfo) -> str:
+    """Epoch seconds to the naive "YYYY-MM-DDTHH:MM" form the calendar API takes."""
+    return datetime.fromtimestamp(ts, tz).strftime("%Y-%m-%dT%H:%M")
+
+
+async def auto_schedule(
+    plan_id: int,
+    start_date: str | None = None,
+    days: int = 14,
+    duration_minutes: int = 60,
+    day_start: str = "09:00",
+    day_end: str = "17:00",
+    per_day: int = 1,
+    dry_run: bool = False,
+) -> dict:
+    """Book the plan's remaining modules, in order, into the first free slots.
+
+    Modules that are completed or already have a block in the window are
+    skipped. Returns {"scheduled": [...], "unscheduled": [...]}; each scheduled
+    entry carries its batch-insert result unless `dry_run`.
+    """
+    tz = ZoneInfo(await google_calendar.get_timezone())
+    first_day = date.fromisoformat(start_date) if start_date else datetime.now(tz).date()
+    duration = duration_minutes * 60
+
+    window_start = int(datetime.combine(first_day, time.min, tz).timestamp())
+    window_end = int(datetime.combine(first_day + timedelta(days=days), time.min, tz).timestamp())
+    # Never book in the past; round up to the next quarter hour.
+    now = -(-int(datetime.now(tz).timestamp()) // 900) * 900
+
+    await google_calendar.sync_events()
+    events = await calendar_store.get_events(window_start, window_end)
+    booked = {e["module_id"] for e in events if e["module_id"] is not None}
+    busy = merge_busy([(e["start_ts"], e["end_ts"]) for e in events])
+
+    pending = [
+        m for m in await get_modules(plan_id)
+        if m["status"] != "completed" and m["id"] not in booked
+    ]
+    windows = working_windows(max(window_start, now), window_end, tz, day_start, day_end)
+    placed: list[tuple[dict, int, int]] = []
+    per_date: dict[date, int] = {}
+    for gap_start, gap_end in free_slots(busy, windows, duration):
+        if not pending:
+            break
+        day = datetime.fromtimestamp(gap_start, tz).date()
+        while pending and per_date.get(day, 0) < per_day and gap_end - gap_start >= duration:
+            placed.append((pending.pop(0), gap_start, gap_start + duration))
+            gap_start += duration
+            per_date[day] = per_date.get(day, 0) + 1
+
+    scheduled = [
+        {
+            "module_id": m["id"],
+            "name": m["name"],
+            "start": _local(start, tz),
+            "end": _local(end, tz),
+        }
+        for m, start, end in placed
+    ]
+    if scheduled and not dry_run:
+        results = await google_calendar.create_module_blocks(
+            [
+                {"module_id": s["module_id"], "title": s["name"], "start": s["start"], "end": s["end"]}
+                for s in scheduled
+            ]
+        )
+        for entry, result in zip(scheduled, results):
+            entry.update(result)
+    return {
+        "scheduled": scheduled,
+        "unscheduled": [{"module_id": m["id"], "name": m["name"]} for m in pending],
+    }
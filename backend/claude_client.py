@@ -5,25 +5,28 @@ import pathlib
 import sys
 from collections.abc import AsyncIterator
 
-from anthropic import AsyncAnthropic
 from dotenv import load_dotenv
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types as mcp_types
 from mcp.client.stdio import stdio_client
 
 from backend.config import MODEL_CHAT
-from backend.agents.course_planner import generate_lesson_plan
-from backend.agents.artifact_seeder import seed_artifacts
-from backend.api.artifact_store import get_artifacts
-from backend.api.lesson_plan_store import set_plan, get_plan, get_plans
-from backend.api.module_store import save_modules, get_modules
+from backend import jobs, llm
+from backend.agents.course_planner import submit_lesson_plan
+from backend.agents.base import record_abort, record_usage
+from backend.api.lesson_plan_store import get_plan_report, get_plans, plans_version
 
 load_dotenv()
 
 log = logging.getLogger(__name__)
 
-_client = AsyncAnthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
-
 MODEL = MODEL_CHAT
+MAX_TOKENS = 2048
+
+# Seconds before a single tool call is cancelled and reported as timed out.
+TOOL_TIMEOUT = float(os.environ.get("TOOL_TIMEOUT", "30"))
+_TOOL_TIMEOUTS = {
+    "create_lesson_plan": 300.0,  # one planner call, two with PLANNER_PIPELINED=0
+}
 
 SYSTEM_PROMPT = (
     "You are Coach — a direct, no-nonsense personal coach. "
@@ -34,6 +37,12 @@ SYSTEM_PROMPT = (
     "Report overall performance, module results, quiz scores, strengths, and next steps."
 )
 
+# Breakpoint after the system prompt caches tools + system together; tools
+# render first in the prompt.
+_SYSTEM_BLOCKS = [
+    {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+]
+
 
 LIST_LESSON_PLANS_TOOL = {
     "name": "list_lesson_plans",
@@ -58,10 +67,43 @@ CREATE_LESSON_PLAN_TOOL = {
 
 _sessions: dict[str, ClientSession] = {}
 _tool_index: dict[str, ClientSession] = {}
+# Tool schemas per MCP server, listed at startup and refreshed only when the
+# server sends notifications/tools/list_changed.
+_mcp_tools: dict[str, list[dict]] = {}
+_refresh_tasks: set[asyncio.Task] = set()
+# (plans_version, tool) — rebuilt only when plans are created/changed/deleted
+_analyze_tool: tuple[int, dict] | None = None
 _mcp_task: asyncio.Task | None = None
 _shutdown: asyncio.Event | None = None
 
 
+async def _refresh_tools(name: str, session: ClientSession) -> None:
+    result = await session.list_tools()
+    for tool_name in [t["name"] for t in _mcp_tools.get(name, [])]:
+        _tool_index.pop(tool_name, None)
+    _mcp_tools[name] = [
+        {"name": t.name, "description": t.description, "input_schema": t.inputSchema}
+        for t in result.tools
+    ]
+    for tool in result.tools:
+        _tool_index[tool.name] = session
+    log.info("MCP %s: %d tools registered", name, len(result.tools))
+
+
+def _message_handler(name: str):
+    async def handle(message) -> None:
+        notification = getattr(message, "root", message)
+        if isinstance(notification, mcp_types.ToolListChangedNotification):
+            # Can't await a request from inside the receive loop; refresh aside.
+            session = _sessions.get(name)
+            if session:
+                task = asyncio.create_task(_refresh_tools(name, session))
+                _refresh_tasks.add(task)
+                task.add_done_callback(_refresh_tasks.discard)
+
+    return handle
+
+
 async def _mcp_lifecycle(ready: asyncio.Event, shutdown: asyncio.Event) -> None:
     server_path = str(
         pathlib.Path(__file__).parent.parent / "mcp_servers" / "wger_server.py"
@@ -79,19 +121,17 @@ async def _mcp_lifecycle(ready: asyncio.Event, shutdown: asyncio.Event) -> None:
         command=sys.executable, args=[context_server_path], env=None, stderr=sys.stderr
     )
     async with stdio_client(wger_params) as (read, write):
-        async with ClientSession(read, write) as session:
+        async with ClientSession(read, write, message_handler=_message_handler("wger")) as session:
             await session.initialize()
             _sessions["wger"] = session
-            tools_result = await session.list_tools()
-            for tool in tools_result.tools:
-                _tool_index[tool.name] = session
+            await _refresh_tools("wger", session)
             async with stdio_client(user_context_params) as (read, write):
-                async with ClientSession(read, write) as session:
+                async with ClientSession(
+                    read, write, message_handler=_message_handler("context")
+                ) as session:
                     await session.initialize()
                     _sessions["context"] = session
-                    tools_result = await session.list_tools()
-                    for tool in tools_result.tools:
-                        _tool_index[tool.name] = session
+                    await _refresh_tools("context", session)
                     ready.set()
                     await shutdown.wait()
 
@@ -157,35 +197,30 @@ async def _build_analyze_tool() -> dict:
     }
 
 
+async def _get_analyze_tool() -> dict:
+    global _analyze_tool
+    version = plans_version()
+    if _analyze_tool is None or _analyze_tool[0] != version:
+        _analyze_tool = (version, await _build_analyze_tool())
+    return _analyze_tool[1]
+
+
 async def _get_all_tools() -> list[dict]:
-    tools = [CREATE_LESSON_PLAN_TOOL, await _build_analyze_tool(), LIST_LESSON_PLANS_TOOL]
-    for session in _sessions.values():
-        result = await session.list_tools()
-        for t in result.tools:
-            tools.append(
-                {
-                    "name": t.name,
-                    "description": t.description,
-                    "input_schema": t.inputSchema,
-                }
-            )
+    tools = [CREATE_LESSON_PLAN_TOOL, await _get_analyze_tool(), LIST_LESSON_PLANS_TOOL]
+    for schemas in _mcp_tools.values():
+        tools.extend(schemas)
     return tools
 
 
 async def _handle_create_lesson_plan(prompt: str) -> str:
-    plan_text, modules = await generate_lesson_plan(prompt)
-    title = next(
-        (line.lstrip("#").strip() for line in plan_text.splitlines() if line.startswith("# ")),
-        "New Lesson Plan",
-    )
-    plan_id = await set_plan(title, plan_text)
-    if modules:
-        await save_modules(plan_id, modules)
-        # Re-fetch from DB so each module carries its DB-assigned id,
-        # which seed_artifacts needs to create artifact rows.
-        saved_modules = await get_modules(plan_id)
-        await seed_artifacts(saved_modules)
-    return f"Lesson plan '{title}' created with {len(modules)} modules."
+    # The job generates and saves the plan: if this call times out or the
+    # chat goes away, the plan is still saved when the job finishes.
+    job = await jobs.wait((await submit_lesson_plan(prompt, save=True))["id"])
+    if job is None or job["status"] != "completed":
+        errors = "; ".join(job["errors"]) if job else "job disappeared"
+        return f"Error: lesson plan generation failed ({errors})"
+    result = job["result"]
+    return f"Lesson plan '{result['title']}' created with {len(result['modules'])} modules."
 
 
 async def _handle_list_lesson_plans() -> str:
@@ -196,36 +231,32 @@ async def _handle_list_lesson_plans() -> str:
 
 
 async def _handle_analyze_lesson(plan_id: int) -> str:
-    plan = await get_plan(plan_id)
+    plan = await get_plan_report(plan_id)
     if not plan:
         return f"No lesson plan found with ID {plan_id}."
-    modules = await get_modules(plan_id)
     lines = [
         f"# Lesson: {plan['title']}",
         f"## Curriculum Rubric\n{plan['plan']}",
         "## Module Results",
     ]
-    for m in modules:
+    for m in plan["modules"]:
         lines.append(f"\n### Module {m['position']}: {m['name']} ({m['type']}, {m['status']})")
         lines.append(f"Goal: {m['description']}")
-        for a in await get_artifacts(m["id"]):
+        for a in m["artifacts"]:
             if not a["data"]:
                 continue
             lines.append(f"\n#### {a['type']}")
-            d = a["data"]
-            if a["type"] == "quiz" and d.get("responses"):
-                qs, rs = d["questions"], d["responses"]
-                score = sum(1 for i, r in enumerate(rs) if r["selected"] == qs[i]["answer"])
-                lines.append(f"Score: {score}/{len(qs)}")
-                for i, (q, r) in enumerate(zip(qs, rs)):
+            d, score = a["data"], a["score"]
+            if a["type"] == "quiz" and score:
+                lines.append(f"Score: {score['done']}/{score['total']}")
+                for i, (q, r) in enumerate(zip(d["questions"], d["responses"])):
                     correct = r["selected"] == q["answer"]
                     answer = q["answer"]
                     mark = "✓" if correct else f"✗ (correct: {answer})"
                     lines.append(f"Q{i+1}: {q['question']}\n  User: {r['selected']} {mark}")
-            elif a["type"] == "checklist" and d.get("items"):
+            elif a["type"] == "checklist" and score:
                 checked = d.get("checked", [])
-                done = sum(1 for c in checked if c)
-                lines.append(f"Completed: {done}/{len(d['items'])}")
+                lines.append(f"Completed: {score['done']}/{score['total']}")
                 for item, c in zip(d["items"], checked + [False] * len(d["items"])):
                     lines.append(f"  {'✓' if c else '○'} {item}")
             elif a["type"] == "exercise":
@@ -233,6 +264,54 @@ async def _handle_analyze_lesson(plan_id: int) -> str:
     return "\n".join(lines)
 
 
+async def _call_tool(name: str, tool_input: dict) -> str:
+    if name == "create_lesson_plan":
+        try:
+            log.info("Tool call: create_lesson_plan")
+            content = await _handle_create_lesson_plan(tool_input["prompt"])
+            log.info("Tool result: %s", content)
+        except Exception as exc:
+            content = f"Failed to create lesson plan: {exc}"
+    elif name == "analyze_lesson":
+        try:
+            log.info("Tool call: analyze_lesson")
+            content = await _handle_analyze_lesson(tool_input["plan_id"])
+            log.info("Tool result: %s", content[:200])
+        except Exception as exc:
+            content = f"Failed to analyze lesson: {exc}"
+    elif name == "list_lesson_plans":
+        try:
+            log.info("Tool call: list_lesson_plans")
+            content = await _handle_list_lesson_plans()
+            log.info("Tool result: %s", content)
+        except Exception as exc:
+            content = f"Failed to list lesson plans: {exc}"
+    else:
+        session = _tool_index.get(name)
+        if session:
+            try:
+                log.info("Tool call: %s %s", name, tool_input)
+                result = await session.call_tool(name, tool_input)
+                content = "\n".join(
+                    c.text for c in result.content if hasattr(c, "text")
+                )
+                log.info("Tool result: %s", content)
+            except Exception as exc:
+                content = f"Tool error: {exc}"
+        else:
+            content = f"Unknown tool: {name}"
+    return content
+
+
+async def _run_tool(name: str, tool_input: dict) -> str:
+    timeout = _TOOL_TIMEOUTS.get(name, TOOL_TIMEOUT)
+    try:
+        return await asyncio.wait_for(_call_tool(name, tool_input), timeout)
+    except asyncio.TimeoutError:
+        log.warning("Tool call timed out: %s after %gs", name, timeout)
+        return f"Tool {name} timed out after {timeout:g}s"
+
+
 def _preamble_for_tool(name: str, tool_input: dict) -> str:
     if name == "create_lesson_plan":
         return "Generating your lesson plan…"
@@ -252,92 +331,96 @@ def _preamble_for_tool(name: str, tool_input: dict) -> str:
     return f"Using {name.replace('_', ' ')}…"
 
 
+def _block_param(block) -> dict:
+    """Request-side dict for a streamed response block (drops SDK-only fields)."""
+    if block.type == "tool_use":
+        return {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}
+    if block.type == "text":
+        return {"type": "text", "text": block.text}
+    return block.model_dump(exclude_none=True)
+
+
+def _with_history_breakpoint(messages: list) -> list:
+    """Copy `messages` with a cache breakpoint on the last content block.
+
+    The breakpoint moves forward every request, so each tool-loop iteration
+    and each follow-up turn reads the conversation so far from cache.
+    """
+    *head, last = messages
+    content = last["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = list(content)
+    blocks[-1] = {**blocks[-1], "cache_control": {"type": "ephemeral"}}
+    return [*head, {**last, "content": blocks}]
+
+
 async def chat_stream(message: str, history: list) -> AsyncIterator[str]:
     messages = [*history, {"role": "user", "content": message}]
     tools = await _get_all_tools()
     kwargs: dict = {"tools": tools} if tools else {}
 
-    # Phase 1: resolve tool calls non-streaming
+    # One streamed request per round: text is forwarded as it arrives, tool
+    # calls start as soon as their block closes, and the loop ends on the
+    # first response that doesn't ask for a tool.
     while True:
-        response = await _client.messages.create(
-            model=MODEL,
-            max_tokens=2048,
-            system=SYSTEM_PROMPT,
-            messages=messages,
-            **kwargs,
+        tasks: list[tuple[str, asyncio.Task]] = []
+        try:
+            streamed = 0
+            try:
+                async with llm.stream(
+                    priority=llm.INTERACTIVE,
+                    model=MODEL,
+                    max_tokens=MAX_TOKENS,
+                    system=_SYSTEM_BLOCKS,
+                    messages=_with_history_breakpoint(messages),
+                    **kwargs,
+                ) as stream:
+                    async for event in stream:
+                        if event.type == "text":
+                            streamed += len(event.text)
+                            safe = event.text.replace("\n", "\\n")
+                            yield f"event: response.message\ndata: {safe}\n\n"
+                        elif (
+                            event.type == "content_block_stop"
+                            and event.content_block.type == "tool_use"
+                        ):
+                            block = event.content_block
+                            preamble = _preamble_for_tool(block.name, block.input)
+                            yield f"event: preamble\ndata: {preamble}\n\n"
+                            tasks.append(
+                                (block.id, asyncio.create_task(_run_tool(block.name, block.input)))
+                            )
+                    response = await stream.get_final_message()
+            except (asyncio.CancelledError, GeneratorExit):
+                # Leaving the `async with` closed the upstream HTTP stream.
+                record_abort("chat", MAX_TOKENS, streamed)
+                raise
+            record_usage("chat", response.usage)
+
+            if response.stop_reason != "tool_use":
+                break
+
+            # Results keep tool_use order regardless of which finishes first.
+            contents = await asyncio.gather(*(task for _, task in tasks))
+        finally:
+            # Client went away mid-turn: don't leave tool calls running.
+            for _, task in tasks:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+
+        messages.append(
+            {"role": "assistant", "content": [_block_param(b) for b in response.content]}
+        )
+        messages.append(
+            {
+                "role": "user",
+                "content": [
+                    {"type": "tool_result", "tool_use_id": tool_use_id, "content": content}
+                    for (tool_use_id, _), content in zip(tasks, contents)
+                ],
+            }
         )
-
-        if response.stop_reason != "tool_use":
-            break  # fall through to streaming final answer
-
-        # Emit preamble for each tool block
-        for block in response.content:
-            if block.type == "tool_use":
-                preamble = _preamble_for_tool(block.name, block.input)
-                yield f"event: preamble\ndata: {preamble}\n\n"
-
-        messages.append({"role": "assistant", "content": response.content})
-
-        tool_results = []
-        for block in response.content:
-            if block.type != "tool_use":
-                continue
-            if block.name == "create_lesson_plan":
-                try:
-                    log.info("Tool call: create_lesson_plan")
-                    content = await _handle_create_lesson_plan(block.input["prompt"])
-                    log.info("Tool result: %s", content)
-                except Exception as exc:
-                    content = f"Failed to create lesson plan: {exc}"
-            elif block.name == "analyze_lesson":
-                try:
-                    log.info("Tool call: analyze_lesson")
-                    content = await _handle_analyze_lesson(block.input["plan_id"])
-                    log.info("Tool result: %s", content[:200])
-                except Exception as exc:
-                    content = f"Failed to analyze lesson: {exc}"
-            elif block.name == "list_lesson_plans":
-                try:
-                    log.info("Tool call: list_lesson_plans")
-                    content = await _handle_list_lesson_plans()
-                    log.info("Tool result: %s", content)
-                except Exception as exc:
-                    content = f"Failed to list lesson plans: {exc}"
-            else:
-                session = _tool_index.get(block.name)
-                if session:
-                    try:
-                        log.info("Tool call: %s %s", block.name, block.input)
-                        result = await session.call_tool(block.name, block.input)
-                        content = "\n".join(
-                            c.text for c in result.content if hasattr(c, "text")
-                        )
-                        log.info("Tool result: %s", content)
-                    except Exception as exc:
-                        content = f"Tool error: {exc}"
-                else:
-                    content = f"Unknown tool: {block.name}"
-
-            tool_results.append(
-                {
-                    "type": "tool_result",
-                    "tool_use_id": block.id,
-                    "content": content,
-                }
-            )
-
-        messages.append({"role": "user", "content": tool_results})
-
-    # Phase 2: stream the final response
-    async with _client.messages.stream(
-        model=MODEL,
-        max_tokens=2048,
-        system=SYSTEM_PROMPT,
-        messages=messages,
-        **kwargs,
-    ) as stream:
-        async for text_delta in stream.text_stream:
-            safe = text_delta.replace("\n", "\\n")
-            yield f"event: response.message\ndata: {safe}\n\n"
 
     yield "event: done\ndata: \n\n"
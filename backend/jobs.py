@@ -0,0 +1,348 @@
+"""Durable background jobs: a SQLite-backed queue drained by an asyncio worker pool.
+
+Job types are registered with `register()` by the modules that own the work.
+`submit()` only writes a row; workers started by `start()` in the app
+lifespan claim queued rows, run their handler, and retry failures with
+backoff. A running job holds a lease that its worker keeps renewing, so a job
+whose process died is picked up again once the lease runs out, and `stop()`
+hands its own running jobs straight back to the queue. Progress is persisted
+on the row and fanned out to local SSE watchers; watchers in other processes
+see it on their next poll.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+from backend import metrics
+from backend.api.db import get_db, get_writer
+
+log = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+# A running job's lease; renewed every LEASE / 3 while its handler runs.
+LEASE = float(os.environ.get("JOB_LEASE", "60"))
+# First retry delay; doubles with each attempt, plus jitter.
+RETRY_BASE = float(os.environ.get("JOB_RETRY_BASE", "2"))
+# Finished jobs are kept this long for late pollers.
+RETENTION = 7 * 24 * 3600
+# Idle workers and SSE watchers re-check the table this often.
+POLL_INTERVAL = 1.0
+
+FINISHED = ("completed", "failed")
+
+_handlers: dict[str, dict] = {}
+_running: dict[str, int] = {}
+_watchers: dict[str, set[asyncio.Queue]] = {}
+_workers: list[asyncio.Task] = []
+_wakeup: asyncio.Event | None = None
+_claim_lock: asyncio.Lock | None = None
+
+
+def register(
+    job_type: str,
+    handler: Callable[[dict], Awaitable[dict | None]],
+    concurrency: int = 1,
+    max_attempts: int = 3,
+) -> None:
+    """Make `job_type` runnable.
+
+    `handler(job)` reads `job["payload"]`, reports units of work through
+    `progress()`, and returns the job's result (JSON-serialisable) or None.
+    It may run more than once for one job (retries, resume after a restart),
+    so it must skip work that an earlier attempt already saved.
+    """
+    _handlers[job_type] = {
+        "run": handler,
+        "concurrency": concurrency,
+        "max_attempts": max_attempts,
+    }
+    _running.setdefault(job_type, 0)
+
+
+def _row_to_job(row) -> dict:
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    job["errors"] = json.loads(job["errors"])
+    return job
+
+
+def _snapshot(job: dict) -> dict:
+    return {
+        key: job[key]
+        for key in (
+            "id", "type", "status", "total", "done", "failed", "errors",
+            "result", "attempts", "created_at", "updated_at",
+        )
+    }
+
+
+def _publish(job: dict) -> None:
+    for queue in _watchers.get(job["id"], ()):
+        queue.put_nowait(_snapshot(job))
+
+
+async def _save(job: dict, *fields: str) -> None:
+    job["updated_at"] = time.time()
+    values = []
+    for field in (*fields, "updated_at"):
+        value = job[field]
+        values.append(json.dumps(value) if field in ("errors", "result") else value)
+    assignments = ", ".join(f"{field} = ?" for field in (*fields, "updated_at"))
+    async with get_writer() as db:
+        await db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*values, job["id"]))
+        await db.commit()
+    _publish(job)
+
+
+async def get_job(job_id: str) -> dict | None:
+    async with get_db() as db:
+        async with db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)) as cursor:
+            row = await cursor.fetchone()
+    return _snapshot(_row_to_job(row)) if row else None
+
+
+async def set_total(job: dict, total: int) -> None:
+    """Set the number of units this attempt will run, resetting its counts."""
+    job["total"], job["done"], job["failed"] = total, 0, 0
+    await _save(job, "total", "done", "failed")
+
+
+async def progress(job: dict, ok: bool, error: str | None = None) -> None:
+    """Record one finished unit of work on a running job."""
+    if ok:
+        job["done"] += 1
+    else:
+        job["failed"] += 1
+        if error:
+            job["errors"].append(error)
+    await _save(job, "done", "failed", "errors")
+
+
+async def checkpoint(job: dict, result: dict) -> None:
+    """Persist a partial result; a retry of the job sees it as job["result"]."""
+    job["result"] = result
+    await _save(job, "result")
+
+
+async def submit(job_type: str, payload: dict, total: int = 0) -> dict:
+    """Queue a job and return its snapshot; a worker picks it up shortly."""
+    now = time.time()
+    job = {
+        "id": uuid.uuid4().hex,
+        "type": job_type,
+        "status": "queued",
+        "payload": payload,
+        "result": None,
+        "total": total,
+        "done": 0,
+        "failed": 0,
+        "errors": [],
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+    async with get_writer() as db:
+        await db.execute(
+            """INSERT INTO jobs (id, type, status, payload, total, run_after, created_at, updated_at)
+               VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)""",
+            (job["id"], job_type, json.dumps(payload), total, now, now, now),
+        )
+        await db.commit()
+    metrics.incr(f"jobs.{job_type}.submitted")
+    if _wakeup is not None:
+        _wakeup.set()
+    return _snapshot(job)
+
+
+# ── Workers ───────────────────────────────────────────────────────────────────
+
+async def _fail_abandoned(db, now: float) -> None:
+    """Fail jobs whose lease ran out on their last allowed attempt.
+
+    Such a job took its worker down with it (or hung it) every time; claiming
+    it again would retry it forever.
+    """
+    for job_type, handler in _handlers.items():
+        async with db.execute(
+            """UPDATE jobs SET status = 'failed', updated_at = ?,
+                    errors = json_insert(errors, '$[#]', ?)
+                WHERE type = ? AND status = 'running' AND lease_until < ?
+                  AND attempts >= ?
+                RETURNING id""",
+            (now, "lease expired on the final attempt", job_type, now, handler["max_attempts"]),
+        ) as cursor:
+            failed = await cursor.fetchall()
+        for row in failed:
+            log.warning("job %s (%s) abandoned on its final attempt", row["id"], job_type)
+            metrics.incr(f"jobs.{job_type}.failed")
+
+
+async def _claim() -> dict | None:
+    """Take the oldest runnable job of a type with spare concurrency."""
+    async with _claim_lock:
+        types = [t for t, h in _handlers.items() if _running[t] < h["concurrency"]]
+        if not types:
+            return None
+        now = time.time()
+        marks = ", ".join("?" * len(types))
+        async with get_writer() as db:
+            await _fail_abandoned(db, now)
+            async with db.execute(
+                f"""UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                        lease_until = ?, updated_at = ?
+                    WHERE id = (
+                        SELECT id FROM jobs
+                        WHERE type IN ({marks})
+                          AND ((status = 'queued' AND run_after <= ?)
+                               OR (status = 'running' AND lease_until < ?))
+                        ORDER BY created_at LIMIT 1
+                    )
+                    RETURNING *""",
+                (now + LEASE, now, *types, now, now),
+            ) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+        if row is None:
+            return None
+        job = _row_to_job(row)
+        _running[job["type"]] += 1
+        return job
+
+
+async def _heartbeat(job_id: str) -> None:
+    while True:
+        await asyncio.sleep(LEASE / 3)
+        async with get_writer() as db:
+            await db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                (time.time() + LEASE, job_id),
+            )
+            await db.commit()
+
+
+async def _execute(job: dict) -> None:
+    handler = _handlers[job["type"]]
+    heartbeat = asyncio.create_task(_heartbeat(job["id"]))
+    start = time.perf_counter()
+    _publish(job)
+    try:
+        job["result"] = await handler["run"](job)
+        job["status"] = "completed"
+        await _save(job, "status", "result")
+        metrics.incr(f"jobs.{job['type']}.completed")
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back without counting this attempt.
+        job["status"] = "queued"
+        job["attempts"] -= 1
+        await _save(job, "status", "attempts")
+        raise
+    except Exception as exc:
+        log.exception("job %s (%s) attempt %d failed", job["id"], job["type"], job["attempts"])
+        job["errors"].append(str(exc))
+        if job["attempts"] < handler["max_attempts"]:
+            delay = RETRY_BASE * 2 ** (job["attempts"] - 1) * random.uniform(1, 1.5)
+            job["status"] = "queued"
+            job["run_after"] = time.time() + delay
+            await _save(job, "status", "errors", "run_after")
+            metrics.incr(f"jobs.{job['type']}.retried")
+        else:
+            job["status"] = "failed"
+            await _save(job, "status", "errors")
+            metrics.incr(f"jobs.{job['type']}.failed")
+    finally:
+        heartbeat.cancel()
+        _running[job["type"]] -= 1
+        metrics.observe(f"jobs.{job['type']}.run", time.perf_counter() - start)
+        # A slot of this type just freed up.
+        _wakeup.set()
+
+
+async def _worker() -> None:
+    while True:
+        _wakeup.clear()
+        try:
+            job = await _claim()
+        except Exception:
+            log.exception("jobs: claim failed")
+            job = None
+        if job is None:
+            try:
+                async with asyncio.timeout(POLL_INTERVAL):
+                    await _wakeup.wait()
+            except TimeoutError:
+                pass
+            continue
+        await _execute(job)
+
+
+async def start() -> None:
+    """Prune old finished jobs and start the worker pool (call after migrations)."""
+    global _wakeup, _claim_lock
+    _wakeup = asyncio.Event()
+    _claim_lock = asyncio.Lock()
+    async with get_writer() as db:
+        await db.execute(
+            "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+            (time.time() - RETENTION,),
+        )
+        await db.commit()
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(WORKERS))
+    log.info("jobs: started %d workers", WORKERS)
+
+
+async def stop() -> None:
+    """Cancel the workers; jobs they were running go back to the queue."""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+# ── Watching ──────────────────────────────────────────────────────────────────
+
+async def _watch(job_id: str) -> AsyncIterator[dict]:
+    """Snapshots of a job as it changes, ending with the finished one."""
+    queue: asyncio.Queue = asyncio.Queue()
+    _watchers.setdefault(job_id, set()).add(queue)
+    try:
+        state = await get_job(job_id)
+        while state is not None:
+            yield state
+            if state["status"] in FINISHED:
+                return
+            try:
+                async with asyncio.timeout(POLL_INTERVAL):
+                    state = await queue.get()
+            except TimeoutError:
+                # Maybe a worker in another process is running it.
+                state = await get_job(job_id)
+    finally:
+        _watchers[job_id].discard(queue)
+        if not _watchers[job_id]:
+            del _watchers[job_id]
+
+
+async def wait(job_id: str) -> dict | None:
+    """Wait for a job to finish and return its final snapshot."""
+    state = None
+    async for state in _watch(job_id):
+        pass
+    return state
+
+
+async def job_events(job_id: str) -> AsyncIterator[str]:
+    """SSE stream of progress snapshots until the job finishes."""
+    seen = False
+    async for state in _watch(job_id):
+        seen = True
+        event = "done" if state["status"] in FINISHED else "progress"
+        yield f"event: {event}\ndata: {json.dumps(state)}\n\n"
+    if not seen:
+        yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
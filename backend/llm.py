@@ -0,0 +1,258 @@
+"""Shared Anthropic gateway: every model call in the app goes through here.
+
+One client, and per model:
+  - a concurrency limit with two priority lanes, so interactive requests
+    (chat, mediator) take the next free slot ahead of background generation;
+  - a token bucket sized from the `anthropic-ratelimit-*` response headers,
+    which holds requests back instead of letting them draw 429s;
+  - jittered exponential retry on 429 / 529, honouring `retry-after`.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from anthropic import APIStatusError, AsyncAnthropic
+from dotenv import load_dotenv
+
+from backend import metrics
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+_LANES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Concurrent requests per model
+CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "4"))
+RETRY_BASE = float(os.environ.get("LLM_RETRY_BASE", "1"))
+_RETRY_STATUSES = (429, 529)
+
+# Retries are ours, so the SDK's own are off.
+_client = AsyncAnthropic(api_key=os.environ["ANTHROPIC_API_KEY"], max_retries=0)
+
+
+class _Lanes:
+    """Counting semaphore whose waiters are served by priority, then FIFO."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int) -> None:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # the slot moves to the waiter as-is
+                return
+        self.in_flight -= 1
+
+    def waiting(self) -> dict:
+        counts = {name: 0 for name in _LANES.values()}
+        for priority, _, fut in self._waiters:
+            if not fut.done():
+                counts[_LANES[priority]] += 1
+        return counts
+
+
+class _Bucket:
+    """Input-token bucket for one model, resynced from every response's headers.
+
+    Until the first response arrives nothing is known, and nothing is held back.
+    """
+
+    def __init__(self):
+        self.capacity: float | None = None
+        self.rate = 0.0  # tokens per second
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if self.capacity is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def observe(self, headers) -> None:
+        now = time.monotonic()
+        limit = headers.get("anthropic-ratelimit-input-tokens-limit")
+        remaining = headers.get("anthropic-ratelimit-input-tokens-remaining")
+        if limit and remaining:
+            # Limits are per minute and replenish continuously.
+            self.capacity = float(limit)
+            self.rate = self.capacity / 60
+            self.tokens = float(remaining)
+            self.updated = now
+        if headers.get("anthropic-ratelimit-requests-remaining") == "0":
+            reset = headers.get("anthropic-ratelimit-requests-reset")
+            if reset:
+                delay = datetime.fromisoformat(reset).timestamp() - time.time()
+                if delay > 0:
+                    self.block(delay)
+
+    async def take(self, cost: float) -> None:
+        start = time.perf_counter()
+        while True:
+            now = time.monotonic()
+            wait = self.blocked_until - now
+            if wait <= 0 and self.capacity is not None:
+                self._refill(now)
+                cost = min(cost, self.capacity)
+                if self.tokens < cost:
+                    wait = (cost - self.tokens) / self.rate
+            if wait <= 0:
+                if self.capacity is not None:
+                    self.tokens -= cost
+                break
+            await asyncio.sleep(wait)
+        metrics.observe("llm.bucket_wait", time.perf_counter() - start)
+
+
+_lanes: dict[str, _Lanes] = {}
+_buckets: dict[str, _Bucket] = {}
+
+
+def _for_model(model: str) -> tuple[_Lanes, _Bucket]:
+    if model not in _lanes:
+        _lanes[model] = _Lanes(CONCURRENCY)
+        _buckets[model] = _Bucket()
+    return _lanes[model], _buckets[model]
+
+
+def _estimate_tokens(kwargs: dict) -> int:
+    """Rough input size (about 4 characters per token) for the bucket."""
+    request = [kwargs.get("system"), kwargs.get("messages"), kwargs.get("tools")]
+    return len(json.dumps(request, default=str)) // 4
+
+
+def _retry_delay(error: APIStatusError, attempt: int) -> float:
+    retry_after = error.response.headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after) * random.uniform(1, 1.2)
+        except ValueError:
+            pass
+    return RETRY_BASE * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+async def _with_retries(model: str, priority: int, cost: int, call):
+    """Await `call()` in a concurrency slot, retrying 429 / 529 with backoff.
+
+    The bucket (and any backoff) is waited on before taking a slot, and the
+    slot is given back while backing off: sleepers never hold slots, so when
+    a rate-limited model recovers, queued interactive requests still go first.
+    Returns with the slot held; the caller releases it.
+    """
+    lanes, bucket = _for_model(model)
+    lane = _LANES[priority]
+    for attempt in range(MAX_RETRIES + 1):
+        await bucket.take(cost)
+        start = time.perf_counter()
+        await lanes.acquire(priority)
+        metrics.observe(f"llm.queue_wait.{lane}", time.perf_counter() - start)
+        try:
+            return await call()
+        except BaseException as e:
+            lanes.release()
+            if (
+                not isinstance(e, APIStatusError)
+                or e.status_code not in _RETRY_STATUSES
+                or attempt == MAX_RETRIES
+            ):
+                raise
+            delay = _retry_delay(e, attempt)
+            metrics.incr(f"llm.retries.{e.status_code}")
+            log.warning(
+                "llm: %s %d, retry %d/%d in %.1fs", model, e.status_code,
+                attempt + 1, MAX_RETRIES, delay,
+            )
+            # Everyone calling this model backs off, not just us.
+            bucket.block(delay)
+
+
+async def create(priority: int = BACKGROUND, **kwargs):
+    """`messages.create` through the gateway; returns the Message."""
+    model = kwargs["model"]
+    lanes, bucket = _for_model(model)
+
+    async def call():
+        raw = await _client.messages.with_raw_response.create(**kwargs)
+        bucket.observe(raw.headers)
+        return await raw.parse()
+
+    message = await _with_retries(model, priority, _estimate_tokens(kwargs), call)
+    lanes.release()
+    return message
+
+
+@asynccontextmanager
+async def stream(priority: int = INTERACTIVE, **kwargs):
+    """`messages.stream` through the gateway; use as `async with llm.stream(...) as s`.
+
+    Retries cover opening the stream only: once events flow, errors propagate.
+    The concurrency slot is held until the context exits.
+    """
+    model = kwargs["model"]
+    lanes, bucket = _for_model(model)
+    manager = None
+
+    async def call():
+        nonlocal manager
+        # A manager can only be entered once; each attempt needs a fresh one.
+        manager = _client.messages.stream(**kwargs)
+        return await manager.__aenter__()
+
+    message_stream = await _with_retries(model, priority, _estimate_tokens(kwargs), call)
+    try:
+        bucket.observe(message_stream.response.headers)
+        yield message_stream
+    finally:
+        try:
+            await manager.__aexit__(None, None, None)
+        finally:
+            lanes.release()
+
+
+def stats() -> dict:
+    """Per-model concurrency, queue depth by lane, and bucket state."""
+    result = {}
+    for model, lanes in _lanes.items():
+        bucket = _buckets[model]
+        bucket._refill(time.monotonic())
+        result[model] = {
+            "limit": lanes.limit,
+            "in_flight": lanes.in_flight,
+            "queued": lanes.waiting(),
+            "tokens": None if bucket.capacity is None else int(bucket.tokens),
+            "capacity": bucket.capacity,
+        }
+    return result
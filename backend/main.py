@@ -1,9 +1,12 @@
+import asyncio
 import logging
 import os
+from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
+from datetime import time
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, RedirectResponse
 from google_auth_oauthlib.flow import Flow
@@ -12,24 +15,27 @@ from pydantic import BaseModel
 logging.basicConfig(level=logging.INFO)
 
 from backend.claude_client import chat_stream, cleanup_mcp, init_mcp
-from backend.agents.course_planner import generate_lesson_plan
-from backend.agents.artifact_seeder import seed_artifacts
-from backend.agents.artifact_generator import generate_artifact
+from backend.agents.course_planner import submit_lesson_plan
+from backend.agents.artifact_seeder import seed_plan
+from backend.agents import artifact_generator
+from backend.agents.artifact_generator import generate_plan_artifacts, submit_artifact
 from backend.agents.mediator import mediator_stream
-from backend.api.lesson_plan_store import create_table as create_plans_table, set_plan, get_plans, delete_plan, update_plan_status
+from backend.api.lesson_plan_store import create_plan, get_plans, delete_plan, update_plan_status
 from backend.api.module_store import (
-    create_table as create_modules_table,
-    save_modules,
     get_modules,
     get_module,
+    get_modules_by_id,
     update_module,
     complete_module,
     delete_module,
     get_all_modules,
 )
+from backend import jobs, llm, metrics
 from backend.api import google_calendar
+from backend.api.scheduling import auto_schedule, find_slots
+from backend.api.db import init_db, close_db, pool_stats
+from backend.api.migrations import run_migrations
 from backend.api.artifact_store import (
-    create_table as create_artifacts_table,
     get_artifacts,
     get_artifact,
     update_artifact,
@@ -39,12 +45,16 @@ from backend.api.artifact_store import (
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await init_db()
+    await run_migrations()
+    await artifact_generator.release_stale_claims()
+    await jobs.start()
     await init_mcp()
-    await create_plans_table()
-    await create_modules_table()
-    await create_artifacts_table()
     yield
     await cleanup_mcp()
+    await jobs.stop()
+    await artifact_generator.cancel_generations()
+    await close_db()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -106,6 +116,28 @@ class CreateHabitRequest(BaseModel):
     duration_minutes: int
 
 
+class ModuleBlock(BaseModel):
+    module_id: int
+    start_time: str   # "YYYY-MM-DDTHH:MM" naive local time
+    end_time: str
+
+
+class CalendarBatchRequest(BaseModel):
+    module_blocks: list[ModuleBlock] = []
+    habits: list[CreateHabitRequest] = []
+
+
+class AutoScheduleRequest(BaseModel):
+    plan_id: int
+    start_date: str | None = None   # "YYYY-MM-DD", defaults to today
+    days: int = 14
+    duration_minutes: int = 60
+    day_start: str = "09:00"
+    day_end: str = "17:00"
+    per_day: int = 1
+    dry_run: bool = False
+
+
 class MediatorHistoryEntry(BaseModel):
     speaker: str
     name: str
@@ -122,6 +154,7 @@ class MediatorRequest(BaseModel):
     thread_b: list[MediatorHistoryEntry] = []
     target: str = "continue"  # "continue", "a", or "b"
     question: str = ""
+    parallel_opening: bool = False  # both open at once instead of A then B
 
 
 _CREDENTIALS_FILE = Path(__file__).parent / "credentials.json"
@@ -131,52 +164,96 @@ _OAUTH_REDIRECT = os.environ.get("OAUTH_REDIRECT_URI", "http://localhost:8000/oa
 _oauth_flow: Flow | None = None
 
 
+# ── Streaming ─────────────────────────────────────────────────────────────────
+
+async def _until_disconnect(
+    request: Request, events: AsyncIterator[str], label: str
+) -> AsyncIterator[str]:
+    """Forward SSE `events` and cancel them as soon as the client disconnects.
+
+    The generator runs in its own task, so a disconnect is noticed even while
+    it is blocked upstream (waiting on the model or a tool call). Cancelling
+    that task unwinds its `messages.stream` contexts and tool-call tasks.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump() -> None:
+        try:
+            async for chunk in events:
+                queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+        else:
+            queue.put_nowait(None)
+
+    async def disconnected() -> None:
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    producer = asyncio.create_task(pump())
+    watcher = asyncio.create_task(disconnected())
+    try:
+        while True:
+            getter = asyncio.create_task(queue.get())
+            await asyncio.wait({getter, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                metrics.incr(f"sse.{label}.disconnects")
+                return
+            item = getter.result()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        watcher.cancel()
+        await asyncio.gather(producer, watcher, return_exceptions=True)
+
+
 # ── Endpoints ─────────────────────────────────────────────────────────────────
 
 @app.post("/chat/stream")
-async def chat_stream_endpoint(req: ChatRequest):
+async def chat_stream_endpoint(req: ChatRequest, request: Request):
     return StreamingResponse(
-        chat_stream(req.message, req.history),
+        _until_disconnect(request, chat_stream(req.message, req.history), "chat"),
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
 @app.post("/mediator/stream")
-async def mediator_stream_endpoint(req: MediatorRequest):
+async def mediator_stream_endpoint(req: MediatorRequest, request: Request):
+    events = mediator_stream(
+        req.topic, req.bot_a_name, req.bot_a_points,
+        req.bot_b_name, req.bot_b_points,
+        [h.model_dump() for h in req.thread_a],
+        [h.model_dump() for h in req.thread_b],
+        req.target,
+        req.question,
+        req.parallel_opening,
+    )
     return StreamingResponse(
-        mediator_stream(
-            req.topic, req.bot_a_name, req.bot_a_points,
-            req.bot_b_name, req.bot_b_points,
-            [h.model_dump() for h in req.thread_a],
-            [h.model_dump() for h in req.thread_b],
-            req.target,
-            req.question,
-        ),
+        _until_disconnect(request, events, "mediator"),
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
-@app.post("/lesson-plan/generate")
+@app.post("/lesson-plan/generate", status_code=202)
 async def lesson_plan_generate(req: LessonPlanRequest):
-    markdown, modules = await generate_lesson_plan(prompt=req.prompt)
-    logging.info("generate: plan_length=%d modules=%d", len(markdown), len(modules))
-    if not markdown:
-        logging.warning("generate: plan text is empty")
-    if not modules:
-        logging.warning("generate: no modules captured")
-    return {"markdown": markdown, "modules": modules}
+    """Queue plan generation; the job's result is {"markdown", "modules"}."""
+    job = await submit_lesson_plan(req.prompt)
+    return {"job_id": job["id"]}
 
 
 @app.post("/lesson-plan/save")
 async def lesson_plan_save(req: SaveLessonPlanRequest):
-    plan_id = await set_plan(req.title, req.plan)
-    if req.modules:
-        await save_modules(plan_id, req.modules)
-        saved_modules = await get_modules(plan_id)
-        await seed_artifacts(saved_modules)
-    return {"id": plan_id}
+    plan_id, saved_modules = await create_plan(req.title, req.plan, req.modules)
+    # No job when the modules carry the planner's artifact assignments.
+    job = await seed_plan(plan_id, saved_modules, req.modules)
+    return {"id": plan_id, "job_id": job["id"] if job else None}
 
 
 @app.get("/lesson-plans")
@@ -253,14 +330,42 @@ async def artifact_delete(artifact_id: int):
     return {"ok": True}
 
 
-@app.post("/artifact/{artifact_id}/generate")
-async def artifact_generate(artifact_id: int):
-    artifact = await get_artifact(artifact_id)
-    if artifact is None:
+@app.post("/artifact/{artifact_id}/generate", status_code=202)
+async def artifact_generate(artifact_id: int, regenerate: bool = False):
+    """Queue generation; GET /artifact/{id} once the job is done."""
+    if await get_artifact(artifact_id) is None:
         raise HTTPException(status_code=404, detail="Artifact not found")
-    module = await get_module(artifact["module_id"])
-    await generate_artifact(artifact, module)
-    return await get_artifact(artifact_id)
+    job = await submit_artifact(artifact_id, regenerate)
+    return {"job_id": job["id"]}
+
+
+@app.post("/lesson-plan/{plan_id}/artifacts/generate", status_code=202)
+async def lesson_plan_generate_artifacts(plan_id: int):
+    job = await generate_plan_artifacts(plan_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Lesson plan not found")
+    return {"job_id": job["id"], "total": job["total"]}
+
+
+# ── Jobs ──────────────────────────────────────────────────────────────────────
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/stream")
+async def job_stream(job_id: str):
+    if await jobs.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        jobs.job_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ── Modules (all) ─────────────────────────────────────────────────────────────
@@ -270,6 +375,13 @@ async def modules_all():
     return {"modules": await get_all_modules()}
 
 
+# ── Metrics ───────────────────────────────────────────────────────────────────
+
+@app.get("/metrics")
+async def metrics_snapshot():
+    return {"db_pool": pool_stats(), "llm": llm.stats(), **metrics.snapshot()}
+
+
 # ── OAuth ──────────────────────────────────────────────────────────────────────
 
 @app.get("/oauth/status")
@@ -298,6 +410,7 @@ async def oauth_callback(code: str):
         raise HTTPException(400, "No OAuth flow in progress. Visit /oauth/start first.")
     _oauth_flow.fetch_token(code=code)
     _TOKEN_FILE.write_text(_oauth_flow.credentials.to_json())
+    google_calendar.reload_credentials()
     _oauth_flow = None
     return {"ok": True, "message": "Authenticated! You can close this tab."}
 
@@ -309,7 +422,7 @@ async def calendar_events(start: str, end: str):
     if not google_calendar.is_authenticated():
         raise HTTPException(401, "Google Calendar not connected.")
     try:
-        return {"events": google_calendar.get_events(start, end)}
+        return {"events": await google_calendar.get_events(start, end)}
     except Exception as e:
         if "invalid_grant" in str(e):
             google_calendar.clear_token()
@@ -317,12 +430,46 @@ async def calendar_events(start: str, end: str):
         raise HTTPException(502, f"Google Calendar error: {e}")
 
 
+@app.get("/calendar/free-slots")
+async def calendar_free_slots(
+    start: str,
+    end: str,
+    duration_minutes: int = 60,
+    day_start: str = "09:00",
+    day_end: str = "17:00",
+    weekdays: list[int] | None = Query(None),   # 0=Mon … 6=Sun
+    source: str = "cache",                     # "cache" or "freebusy"
+    limit: int | None = None,
+):
+    if not google_calendar.is_authenticated():
+        raise HTTPException(401, "Google Calendar not connected.")
+    if source not in ("cache", "freebusy"):
+        raise HTTPException(400, "source must be 'cache' or 'freebusy'")
+    try:
+        start_ts, end_ts = google_calendar.epoch(start), google_calendar.epoch(end)
+    except ValueError:
+        raise HTTPException(400, "start and end must be ISO 8601 datetimes")
+    if end_ts <= start_ts:
+        raise HTTPException(400, "end must be after start")
+    try:
+        open_at, close_at = time.fromisoformat(day_start), time.fromisoformat(day_end)
+    except ValueError:
+        raise HTTPException(400, "day_start and day_end must be HH:MM")
+    if close_at <= open_at:
+        raise HTTPException(400, "day_end must be after day_start")
+    return {
+        "slots": await find_slots(
+            start, end, duration_minutes, day_start, day_end, weekdays, source, limit
+        )
+    }
+
+
 @app.post("/calendar/module-blocks")
 async def calendar_create_module_block(req: CreateModuleBlockRequest):
     module = await get_module(req.module_id)
     if module is None:
         raise HTTPException(404, "Module not found")
-    event_id = google_calendar.create_module_block(
+    event_id = await google_calendar.create_module_block(
         req.module_id, module["name"], req.start_time, req.end_time
     )
     return {"id": event_id}
@@ -330,13 +477,47 @@ async def calendar_create_module_block(req: CreateModuleBlockRequest):
 
 @app.post("/calendar/habits")
 async def calendar_create_habit(req: CreateHabitRequest):
-    event_id = google_calendar.create_habit(
+    event_id = await google_calendar.create_habit(
         req.title, req.days_of_week, req.start_time, req.duration_minutes
     )
     return {"id": event_id}
 
 
+@app.post("/calendar/batch")
+async def calendar_batch(req: CalendarBatchRequest):
+    """Create many module blocks and habits; results are per item, in request order."""
+    block_results: list[dict | None] = [None] * len(req.module_blocks)
+    blocks, block_index = [], []
+    modules = await get_modules_by_id([b.module_id for b in req.module_blocks])
+    for i, block in enumerate(req.module_blocks):
+        module = modules.get(block.module_id)
+        if module is None:
+            block_results[i] = {"ok": False, "error": "Module not found"}
+            continue
+        blocks.append(
+            {
+                "module_id": block.module_id,
+                "title": module["name"],
+                "start": block.start_time,
+                "end": block.end_time,
+            }
+        )
+        block_index.append(i)
+    for i, result in zip(block_index, await google_calendar.create_module_blocks(blocks)):
+        block_results[i] = result
+
+    habit_results = await google_calendar.create_habits([h.model_dump() for h in req.habits])
+    return {"module_blocks": block_results, "habits": habit_results}
+
+
+@app.post("/calendar/auto-schedule")
+async def calendar_auto_schedule(req: AutoScheduleRequest):
+    if not google_calendar.is_authenticated():
+        raise HTTPException(401, "Google Calendar not connected.")
+    return await auto_schedule(**req.model_dump())
+
+
 @app.delete("/calendar/events/{event_id:path}")
 async def calendar_delete_event(event_id: str):
-    google_calendar.delete_event(event_id)
+    await google_calendar.delete_event(event_id)
     return {"ok": True}
@@ -0,0 +1,37 @@
+"""In-process counters and timings, served from GET /metrics."""
+
+import time
+from contextlib import contextmanager
+
+_counters: dict[str, float] = {}
+_timings: dict[str, dict] = {}
+
+
+def incr(name: str, amount: float = 1) -> None:
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record one duration sample (count / total / max, in milliseconds)."""
+    t = _timings.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+    ms = seconds * 1000
+    t["count"] += 1
+    t["total_ms"] += ms
+    t["max_ms"] = max(t["max_ms"], ms)
+
+
+@contextmanager
+def timed(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def snapshot() -> dict:
+    timings = {
+        name: {**t, "avg_ms": t["total_ms"] / t["count"] if t["count"] else 0.0}
+        for name, t in _timings.items()
+    }
+    return {"counters": dict(_counters), "timings": timings}
@@ -0,0 +1,111 @@
+"""
+Scan vs. index timings for the lesson-plan schema.
+
+Builds a throwaway database with the baseline schema, fills it with
+10k plans (6 modules and 2 artifacts each), times the store's hot queries,
+then applies the index migration and times them again.
+
+    python -m backend.scripts.bench_indexes [--plans 10000]
+"""
+
+import argparse
+import asyncio
+import pathlib
+import tempfile
+import time
+
+import aiosqlite
+
+from backend.api.migrations import MIGRATIONS
+
+MODULES_PER_PLAN = 6
+ARTIFACTS_PER_MODULE = 2
+ROUNDS = 200
+
+QUERIES = {
+    "modules by plan_id": (
+        "SELECT * FROM modules WHERE plan_id = ? ORDER BY position",
+        lambda i, n: (i % n + 1,),
+    ),
+    "unlock next module": (
+        "SELECT id FROM modules WHERE plan_id = ? AND position = ? AND status = 'locked'",
+        lambda i, n: (i % n + 1, 2),
+    ),
+    "artifacts by module_id": (
+        "SELECT * FROM artifacts WHERE module_id = ? ORDER BY id",
+        lambda i, n: (i % (n * MODULES_PER_PLAN) + 1,),
+    ),
+    "newest 20 plans": (
+        "SELECT id, title FROM lesson_plans ORDER BY created_at DESC LIMIT 20",
+        lambda i, n: (),
+    ),
+}
+
+
+async def _populate(db: aiosqlite.Connection, plans: int) -> None:
+    await db.executemany(
+        "INSERT INTO lesson_plans (id, title, plan, created_at) "
+        "VALUES (?, ?, 'plan', datetime('now', ?))",
+        ((p, f"Plan {p}", f"-{p} minutes") for p in range(1, plans + 1)),
+    )
+    await db.executemany(
+        "INSERT INTO modules (plan_id, position, name, description, type) "
+        "VALUES (?, ?, 'module', 'desc', 'conceptual')",
+        ((p, pos) for p in range(1, plans + 1) for pos in range(1, MODULES_PER_PLAN + 1)),
+    )
+    await db.executemany(
+        "INSERT INTO artifacts (module_id, type) VALUES (?, 'quiz')",
+        (
+            (m,)
+            for m in range(1, plans * MODULES_PER_PLAN + 1)
+            for _ in range(ARTIFACTS_PER_MODULE)
+        ),
+    )
+    await db.commit()
+
+
+async def _time_queries(db: aiosqlite.Connection, plans: int) -> dict[str, float]:
+    timings = {}
+    for label, (sql, params) in QUERIES.items():
+        start = time.perf_counter()
+        for i in range(ROUNDS):
+            async with db.execute(sql, params(i * 7919, plans)) as cursor:
+                await cursor.fetchall()
+        timings[label] = (time.perf_counter() - start) / ROUNDS * 1000
+    # Cascading delete of one plan → 6 modules → 12 artifacts
+    start = time.perf_counter()
+    for p in range(1, 21):
+        await db.execute("DELETE FROM lesson_plans WHERE id = ?", (p,))
+    await db.rollback()
+    timings["cascade delete plan"] = (time.perf_counter() - start) / 20 * 1000
+    return timings
+
+
+async def main(plans: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiosqlite.connect(str(pathlib.Path(tmp) / "bench.db")) as db:
+            await db.execute("PRAGMA foreign_keys = ON")
+            baseline = next(m for v, _, m in MIGRATIONS if v == 1)
+            indexes = next(m for v, _, m in MIGRATIONS if v == 2)
+
+            await baseline(db)
+            await _populate(db, plans)
+            scan = await _time_queries(db, plans)
+
+            await indexes(db)
+            await db.commit()
+            await db.execute("ANALYZE")
+            indexed = await _time_queries(db, plans)
+
+    print(f"{plans} plans, {plans * MODULES_PER_PLAN} modules, "
+          f"{plans * MODULES_PER_PLAN * ARTIFACTS_PER_MODULE} artifacts (ms per query)")
+    print(f"{'query':<26}{'scan':>10}{'indexed':>10}{'speedup':>10}")
+    for label in scan:
+        s, i = scan[label], indexed[label]
+        print(f"{label:<26}{s:>10.3f}{i:>10.3f}{s / i:>9.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plans", type=int, default=10_000)
+    asyncio.run(main(parser.parse_args().plans))
@@ -0,0 +1,128 @@
+"""
+End-to-end plan creation timings, two-step vs. pipelined planner.
+
+Replaces `llm.create` with a stub that answers each planner call with canned
+output after a simulated round trip: a fixed time to first token plus the
+output length at a steady token rate. Each round generates a plan, saves it to
+a throwaway database and seeds its artifact stubs, as the create_lesson_plan
+chat tool does, and records when the plan was saved and when it was seeded.
+
+    python -m backend.scripts.bench_planner [--ttft 1.0] [--tps 80] [--rounds 3]
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+# The stub never reaches the API; the response cache would hide later rounds
+# of the two-step extraction.
+os.environ.setdefault("ANTHROPIC_API_KEY", "bench")
+os.environ["LLM_CACHE"] = "0"
+os.environ["DB_DIR"] = tempfile.mkdtemp(prefix="bench_planner_")
+
+from backend import llm  # noqa: E402
+from backend.agents import artifact_seeder, course_planner  # noqa: E402
+from backend.api.db import close_db, init_db  # noqa: E402
+from backend.api.lesson_plan_store import create_plan  # noqa: E402
+from backend.api.migrations import run_migrations  # noqa: E402
+
+INTAKE = "I want to learn to climb 5.11 outdoors within a year. I boulder twice a week."
+MODULES = [
+    {"name": f"Module {i}", "description": f"Can do step {i} of the climbing progression", "type": t}
+    for i, t in enumerate(["conceptual", "physical", "physical", "applicable", "physical", "applicable"], 1)
+]
+MARKDOWN = "\n".join(
+    ["# Climbing 5.11 Outdoors", "", "> **Purpose:** " + "Build strength and technique. " * 12, "",
+     "## Instructor Directives", *["- " + "Push hard on footwork and rest discipline. " * 3] * 5, "",
+     "## Curriculum Overview", "",
+     *[f"{i}. {m['name']} — {m['description']}" for i, m in enumerate(MODULES, 1)]]
+)
+ARTIFACTS = [["reading", "quiz"], ["exercise"], ["exercise", "checklist"], ["project"], ["exercise"], ["project", "checklist"]]
+
+
+class StubLLM:
+    """Canned planner responses with a simulated round-trip latency."""
+
+    def __init__(self, ttft: float, tps: float):
+        self.ttft = ttft
+        self.tps = tps
+        self.calls = 0
+
+    async def create(self, priority: int = llm.BACKGROUND, **kwargs):
+        self.calls += 1
+        tool = kwargs.get("tool_choice", {}).get("name")
+        if tool is None:
+            block = SimpleNamespace(type="text", text=MARKDOWN)
+            out = MARKDOWN
+        else:
+            if tool == "save_modules":
+                data = {"modules": MODULES}
+            elif tool == "assign_artifacts":
+                ids = [int(i) for i in re.findall(r"id=(\d+)", kwargs["messages"][0]["content"])]
+                data = {"assignments": [
+                    {"module_id": i, "type": t} for i, types in zip(ids, ARTIFACTS) for t in types
+                ]}
+            else:
+                data = {
+                    "markdown": MARKDOWN,
+                    "modules": [{**m, "artifacts": a} for m, a in zip(MODULES, ARTIFACTS)],
+                }
+            block = SimpleNamespace(type="tool_use", name=tool, input=data)
+            out = repr(data)
+        output_tokens = len(out) // 4
+        await asyncio.sleep(self.ttft + output_tokens / self.tps)
+        usage = SimpleNamespace(
+            input_tokens=len(repr(kwargs)) // 4, output_tokens=output_tokens,
+            cache_read_input_tokens=0, cache_creation_input_tokens=0,
+        )
+        return SimpleNamespace(content=[block], stop_reason="end_turn", usage=usage)
+
+
+async def _create(pipelined: bool) -> tuple[float, float, int]:
+    """One plan, end to end: (seconds to saved, seconds to seeded, artifacts)."""
+    start = time.perf_counter()
+    markdown, modules = await course_planner.generate_lesson_plan(INTAKE, pipelined=pipelined)
+    plan_id, saved = await create_plan("Climbing 5.11 Outdoors", markdown, modules)
+    saved_at = time.perf_counter() - start
+    artifacts = await artifact_seeder.save_assigned(saved, modules)
+    if artifacts is None:
+        # What the seed_artifacts job does once a worker picks it up.
+        modules = [{k: m[k] for k in ("id", "name", "type", "description")} for m in saved]
+        artifacts = await artifact_seeder.seed_artifacts(modules)
+    return saved_at, time.perf_counter() - start, len(artifacts)
+
+
+async def main(ttft: float, tps: float, rounds: int) -> None:
+    stub = StubLLM(ttft, tps)
+    llm.create = stub.create
+    await init_db()
+    await run_migrations()
+    try:
+        print(f"stub LLM: {ttft:.2f}s to first token, {tps:.0f} tokens/s; {rounds} rounds")
+        print(f"  {'mode':<12}{'calls':>7}{'saved':>10}{'seeded':>10}{'artifacts':>11}")
+        for name, pipelined in (("two-step", False), ("pipelined", True)):
+            stub.calls = 0
+            results = [await _create(pipelined) for _ in range(rounds)]
+            saved_at = sum(r[0] for r in results) / rounds
+            seeded_at = sum(r[1] for r in results) / rounds
+            print(
+                f"  {name:<12}{stub.calls / rounds:>7.0f}{saved_at:>9.2f}s{seeded_at:>9.2f}s"
+                f"{results[-1][2]:>11}"
+            )
+    finally:
+        await close_db()
+        shutil.rmtree(os.environ["DB_DIR"], ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ttft", type=float, default=1.0, help="seconds to first token")
+    parser.add_argument("--tps", type=float, default=80, help="output tokens per second")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.ttft, args.tps, args.rounds))
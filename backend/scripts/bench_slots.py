@@ -0,0 +1,120 @@
+"""
+Free-slot finder timings over a long, busy calendar.
+
+Fills a throwaway calendar mirror with daily recurring habits (expanded into
+instances, as the sync stores them) plus random one-off events, then times
+the busy-interval read, the merge, and the slot sweep. For comparison it also
+times the naive per-day scan that filters the full event list for every day.
+
+    python -m backend.scripts.bench_slots [--days 180] [--events 5000]
+"""
+
+import argparse
+import asyncio
+import pathlib
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import aiosqlite
+
+from backend.api.migrations import MIGRATIONS
+from backend.api.scheduling import free_slots, merge_busy, working_windows
+
+TZ = ZoneInfo("America/New_York")
+HABITS = [("07:00", 30), ("12:30", 45), ("18:00", 60)]
+DURATION = 60 * 60
+ROUNDS = 20
+
+
+def _instances(start: date, days: int, events: int) -> list[tuple]:
+    rows = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        for n, (at, minutes) in enumerate(HABITS):
+            s = int(datetime.combine(day, datetime.strptime(at, "%H:%M").time(), TZ).timestamp())
+            rows.append((f"habit{n}_{d}", s, s + minutes * 60, f"habit{n}"))
+    rng = random.Random(7)
+    span_start = int(datetime.combine(start, datetime.min.time(), TZ).timestamp())
+    for i in range(max(0, events - len(rows))):
+        s = span_start + rng.randrange(days * 86400 // 900) * 900
+        rows.append((f"event{i}", s, s + rng.choice((30, 60, 90, 120)) * 60, None))
+    return rows
+
+
+def _naive(events: list[tuple[int, int]], start: date, days: int) -> list[tuple[int, int]]:
+    slots = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        w_start = int(datetime.combine(day, datetime.strptime("09:00", "%H:%M").time(), TZ).timestamp())
+        w_end = int(datetime.combine(day, datetime.strptime("17:00", "%H:%M").time(), TZ).timestamp())
+        todays = sorted(e for e in events if e[0] < w_end and e[1] > w_start)
+        cursor = w_start
+        for b_start, b_end in todays:
+            if b_start - cursor >= DURATION:
+                slots.append((cursor, b_start))
+            cursor = max(cursor, b_end)
+        if w_end - cursor >= DURATION:
+            slots.append((cursor, w_end))
+    return slots
+
+
+def _ms(fn, rounds: int = ROUNDS) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+async def main(days: int, events: int) -> None:
+    start = date(2030, 1, 1)
+    rows = _instances(start, days, events)
+    range_start = int(datetime.combine(start, datetime.min.time(), TZ).timestamp())
+    range_end = int(datetime.combine(start + timedelta(days=days), datetime.min.time(), TZ).timestamp())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiosqlite.connect(str(pathlib.Path(tmp) / "bench.db")) as db:
+            for _, _, migrate in MIGRATIONS:
+                await migrate(db)
+            await db.executemany(
+                "INSERT INTO calendar_events (id, title, start, end, start_ts, end_ts, type, series_id) "
+                "VALUES (?, 'event', '', '', ?, ?, 'external', ?)",
+                rows,
+            )
+            await db.execute(
+                "INSERT INTO calendar_sync (calendar_id, synced_at, max_duration) "
+                "VALUES ('primary', 0, 7200)"
+            )
+            await db.commit()
+
+            read_start = time.perf_counter()
+            for _ in range(ROUNDS):
+                async with db.execute(
+                    "SELECT start_ts, end_ts FROM calendar_events "
+                    "WHERE start_ts >= ? - 7200 AND start_ts < ? AND end_ts > ? ORDER BY start_ts",
+                    (range_start, range_end, range_start),
+                ) as cursor:
+                    busy = [(r[0], r[1]) for r in await cursor.fetchall()]
+            read_ms = (time.perf_counter() - read_start) / ROUNDS * 1000
+
+    merged = merge_busy(busy)
+    windows = working_windows(range_start, range_end, TZ)
+    sweep = free_slots(merged, windows, DURATION)
+    assert sweep == _naive(busy, start, days), "sweep and naive scan disagree"
+
+    print(f"{len(rows)} events over {days} days, {len(windows)} working days, {len(sweep)} slots")
+    print(f"  {'read busy (indexed)':<24}{read_ms:>9.2f} ms")
+    print(f"  {'merge':<24}{_ms(lambda: merge_busy(busy)):>9.2f} ms")
+    print(f"  {'working windows':<24}{_ms(lambda: working_windows(range_start, range_end, TZ)):>9.2f} ms")
+    print(f"  {'sweep':<24}{_ms(lambda: free_slots(merged, windows, DURATION)):>9.2f} ms")
+    print(f"  {'naive per-day scan':<24}{_ms(lambda: _naive(busy, start, days), 3):>9.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--events", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.days, args.events))
@@ -3,6 +3,7 @@ import ReactMarkdown from "react-markdown";
 import remarkGfm from "remark-gfm";
 import type { Module, Artifact, QuizData, ExerciseItem } from "../types";
 import CodeRunner from "./CodeRunner";
+import { readSSEStream } from "../../lib/sse";
 
 interface Props {
   module: Module;
@@ -12,6 +13,23 @@ interface Props {
 
 const API_BASE = import.meta.env.VITE_API_BASE_URL;
 
+// Queue generation, wait for the job to finish, then read the saved artifact.
+async function generateArtifact(id: number): Promise<Artifact> {
+  const res = await fetch(`${API_BASE}/artifact/${id}/generate`, { method: "POST" });
+  if (!res.ok) throw new Error("Generate failed");
+  const { job_id } = await res.json();
+  const stream = await fetch(`${API_BASE}/jobs/${job_id}/stream`);
+  if (!stream.ok || !stream.body) throw new Error("Job stream failed");
+  let status = "";
+  await readSSEStream(stream.body, (eventType, eventData) => {
+    if (eventType !== "done") return;
+    status = JSON.parse(eventData).status;
+    return "stop";
+  });
+  if (status !== "completed") throw new Error("Generation failed");
+  return (await fetch(`${API_BASE}/artifact/${id}`)).json();
+}
+
 function persistArtifact(id: number, data: object) {
   fetch(`${API_BASE}/artifact/${id}`, {
     method: "PUT",
@@ -299,9 +317,8 @@ export default function ModuleModal({ module, onClose, onComplete }: Props) {
 
         Promise.allSettled(
           empty.map((a) =>
-            fetch(`${API_BASE}/artifact/${a.id}/generate`, { method: "POST" })
-              .then((r) => r.json())
-              .then((updated: Artifact) => {
+            generateArtifact(a.id)
+              .then((updated) => {
                 setArtifacts((prev) =>
                   prev.map((x) => (x.id === updated.id ? updated : x))
                 );
@@ -23,7 +23,8 @@ interface SetupState {
   botBPoints: string
 }
 
-export default function Mediator() {
+// parallelOpening: both sides open at once instead of B answering A's opening
+export default function Mediator({ parallelOpening = false }: { parallelOpening?: boolean }) {
   const [phase, setPhase] = useState<Phase>('setup')
   const [setup, setSetup] = useState<SetupState>({
     topic: '',
@@ -96,31 +97,33 @@ export default function Mediator() {
           thread_b: buildThread(snapshot, 'b'),
           target,
           question,
+          parallel_opening: parallelOpening,
         }),
       })
 
       if (!res.ok || !res.body) throw new Error('Stream failed')
 
-      let currentIdx: number | null = null
+      // Message index per speaker id: in a parallel opening both sides stream at once
+      const indices: Record<string, number> = {}
+      let count = snapshot.length
 
       await readSSEStream(res.body, (eventType, eventData) => {
         if (eventType === 'speaker') {
           const { id, name } = JSON.parse(eventData)
-          setMessages((prev) => {
-            const next = [...prev, { speaker: id, name, content: '', streaming: true } as MediatorMsg]
-            currentIdx = next.length - 1
-            return next
-          })
-        } else if (eventType === 'delta' && currentIdx !== null) {
-          const { text } = JSON.parse(eventData)
-          const idx = currentIdx
+          indices[id] = count++
+          setMessages((prev) => [...prev, { speaker: id, name, content: '', streaming: true } as MediatorMsg])
+        } else if (eventType === 'delta') {
+          const { id, text } = JSON.parse(eventData)
+          const idx = indices[id]
+          if (idx === undefined) return
           setMessages((prev) => {
             const next = [...prev]
             next[idx] = { ...next[idx], content: next[idx].content + text }
             return next
           })
-        } else if (eventType === 'turn_done' && currentIdx !== null) {
-          const idx = currentIdx
+        } else if (eventType === 'turn_done') {
+          const idx = indices[JSON.parse(eventData).id]
+          if (idx === undefined) return
           setMessages((prev) => {
             const next = [...prev]
             next[idx] = { ...next[idx], streaming: false }
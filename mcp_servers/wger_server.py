@@ -3,15 +3,27 @@ Wger MCP Server
 
 Exposes Wger exercise tools to Claude via the MCP stdio transport.
 Auth: API key in .env (WGER_API_KEY). Base URL: https://wger.de/api/v2/
+(override with WGER_BASE_URL, e.g. to point tests at a local stub server).
+
+Per-muscle responses are cached in data/wger-cache.db for WGER_CACHE_TTL
+seconds and revalidated with If-None-Match once stale.
+
+The same database holds a local FTS5 index of the full catalogue, refreshed in
+the background at startup when stale. Run `python wger_server.py --sync` to
+rebuild it by hand.
 """
 
 import asyncio
 import html
 import json
 import os
+import pathlib
 import re
 import sys
+import time
+from typing import Literal
 
+import aiosqlite
 import httpx
 from dotenv import load_dotenv
 from mcp.server import Server
@@ -22,8 +34,12 @@ from pydantic import BaseModel, Field
 
 load_dotenv()
 
-WGER_BASE = "https://wger.de/api/v2"
+WGER_BASE = os.environ.get("WGER_BASE_URL", "https://wger.de/api/v2").rstrip("/")
 WGER_API_KEY = os.environ.get("WGER_API_KEY", "")
+CACHE_TTL = float(os.environ.get("WGER_CACHE_TTL", "86400"))
+
+_default_dir = pathlib.Path(__file__).parent.parent / "data"
+CACHE_PATH = pathlib.Path(os.environ.get("DB_DIR", str(_default_dir))) / "wger-cache.db"
 
 # Wger muscle IDs — https://wger.de/api/v2/muscle/
 MUSCLE_NAME_TO_ID: dict[str, int] = {
@@ -87,6 +103,329 @@ def _is_english(translation: dict) -> bool:
     return False
 
 
+def _normalize(ex: dict) -> dict | None:
+    """Flatten a wger exerciseinfo result; None if it has no English name."""
+    en = next((t for t in ex.get("translations", []) if _is_english(t)), None)
+    if not en or not en.get("name"):
+        return None
+    raw_desc = en.get("description", "")
+    return {
+        "id": ex["id"],
+        "name": en["name"],
+        "category": ex.get("category", {}).get("name", ""),
+        "muscles_primary": [m["name_en"] for m in ex.get("muscles", [])],
+        "muscles_secondary": [m["name_en"] for m in ex.get("muscles_secondary", [])],
+        "equipment": [e["name"] for e in ex.get("equipment", [])] or ["bodyweight"],
+        "description": _strip_html(raw_desc) if raw_desc else "",
+        "videos": [v["video"] for v in ex.get("videos", []) if v.get("video")],
+    }
+
+
+# ── HTTP client and response cache ───────────────────────────────────────────
+
+_client: httpx.AsyncClient | None = None
+_cache_db: aiosqlite.Connection | None = None
+_cache_lock = asyncio.Lock()
+# Fresh entries mirrored in memory: muscle_id → (fetched_at, results)
+_memory: dict[int, tuple[float, list]] = {}
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        headers = {"Authorization": f"Token {WGER_API_KEY}"} if WGER_API_KEY else {}
+        _client = httpx.AsyncClient(
+            base_url=WGER_BASE,
+            headers=headers,
+            http2=True,
+            timeout=15,
+            limits=httpx.Limits(max_connections=10, keepalive_expiry=120),
+        )
+    return _client
+
+
+async def _get_cache() -> aiosqlite.Connection:
+    global _cache_db
+    # Tool calls run concurrently; without the lock two could each open a
+    # connection, or one could get it before the schema exists.
+    async with _cache_lock:
+        if _cache_db is None:
+            CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            db = await aiosqlite.connect(str(CACHE_PATH))
+            await db.execute("PRAGMA journal_mode = WAL")
+            await db.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS muscle_responses (
+                        muscle_id INTEGER PRIMARY KEY,
+                        body TEXT NOT NULL,
+                        etag TEXT,
+                        fetched_at REAL NOT NULL
+                    )"""
+            )
+            for statement in _CATALOGUE_SCHEMA:
+                await db.execute(statement)
+            await db.commit()
+            _cache_db = db
+    return _cache_db
+
+
+async def _store(muscle_id: int, results: list, etag: str | None) -> None:
+    now = time.time()
+    _memory[muscle_id] = (now, results)
+    db = await _get_cache()
+    await db.execute(
+        "INSERT OR REPLACE INTO muscle_responses (muscle_id, body, etag, fetched_at) VALUES (?, ?, ?, ?)",
+        (muscle_id, json.dumps(results), etag, now),
+    )
+    await db.commit()
+
+
+async def _fetch_muscle(muscle_id: int) -> list[dict]:
+    """Raw exerciseinfo results for one muscle, from cache when fresh."""
+    cached = _memory.get(muscle_id)
+    if cached and time.time() - cached[0] < CACHE_TTL:
+        return cached[1]
+
+    db = await _get_cache()
+    async with db.execute(
+        "SELECT body, etag, fetched_at FROM muscle_responses WHERE muscle_id = ?",
+        (muscle_id,),
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row:
+        body, etag, fetched_at = row
+        results = json.loads(body)
+        if time.time() - fetched_at < CACHE_TTL:
+            _memory[muscle_id] = (fetched_at, results)
+            return results
+    else:
+        results, etag = None, None
+
+    try:
+        resp = await _get_client().get(
+            "/exerciseinfo/",
+            params={"format": "json", "language": 2, "muscles": muscle_id, "limit": 10},
+            headers={"If-None-Match": etag} if etag else None,
+        )
+        if resp.status_code == 304 and results is not None:
+            await _store(muscle_id, results, etag)
+            return results
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        if results is not None:
+            print(f"wger unavailable, serving stale muscle {muscle_id}", file=sys.stderr)
+            return results
+        raise
+
+    results = resp.json().get("results", [])
+    await _store(muscle_id, results, resp.headers.get("etag"))
+    return results
+
+
+# ── Local catalogue ───────────────────────────────────────────────────────────
+# The full English exercise catalogue mirrored into wger-cache.db with an FTS5
+# index, so searches are answered locally. Refreshed in the background when
+# older than CATALOGUE_MAX_AGE, or on demand with `wger_server.py --sync`.
+
+CATALOGUE_MAX_AGE = float(os.environ.get("WGER_CATALOGUE_MAX_AGE", str(7 * 86400)))
+_PAGE_SIZE = 100
+
+_CATALOGUE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS exercises (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        description TEXT NOT NULL,
+        muscles_primary TEXT NOT NULL,
+        muscles_secondary TEXT NOT NULL,
+        equipment TEXT NOT NULL,
+        videos TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS exercise_muscles (
+        muscle_id INTEGER NOT NULL,
+        exercise_id INTEGER NOT NULL,
+        is_primary INTEGER NOT NULL,
+        PRIMARY KEY (muscle_id, exercise_id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS exercise_equipment (
+        exercise_id INTEGER NOT NULL,
+        name TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_exercise_equipment ON exercise_equipment(name, exercise_id)",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS exercises_fts USING fts5(
+        name, description, category, muscles, equipment, tokenize = 'porter'
+    )""",
+    """CREATE TABLE IF NOT EXISTS catalogue_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )""",
+]
+
+
+async def _fetch_page(offset: int) -> dict:
+    resp = await _get_client().get(
+        "/exerciseinfo/",
+        params={"format": "json", "language": 2, "limit": _PAGE_SIZE, "offset": offset},
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def sync_catalogue() -> int:
+    """Pull every exercise from wger and rebuild the local index. Returns the count."""
+    first = await _fetch_page(0)
+    offsets = range(_PAGE_SIZE, first.get("count", 0), _PAGE_SIZE)
+    semaphore = asyncio.Semaphore(4)
+
+    async def page(offset: int) -> dict:
+        async with semaphore:
+            return await _fetch_page(offset)
+
+    pages = [first, *await asyncio.gather(*(page(o) for o in offsets))]
+
+    rows, muscles, equipment, fts = [], [], [], []
+    seen: set[int] = set()
+    for p in pages:
+        for ex in p.get("results", []):
+            entry = _normalize(ex)
+            if not entry or entry["id"] in seen:
+                continue
+            seen.add(entry["id"])
+            rows.append(
+                (
+                    entry["id"], entry["name"], entry["category"], entry["description"],
+                    json.dumps(entry["muscles_primary"]), json.dumps(entry["muscles_secondary"]),
+                    json.dumps(entry["equipment"]), json.dumps(entry["videos"]),
+                )
+            )
+            for key, primary in (("muscles", 1), ("muscles_secondary", 0)):
+                for m in ex.get(key, []):
+                    muscles.append((m["id"], entry["id"], primary))
+            equipment += [(entry["id"], e.lower()) for e in entry["equipment"]]
+            fts.append(
+                (
+                    entry["id"], entry["name"], entry["description"], entry["category"],
+                    " ".join(entry["muscles_primary"] + entry["muscles_secondary"]),
+                    " ".join(entry["equipment"]),
+                )
+            )
+
+    # Own connection: the swap is one transaction that searches on the shared
+    # connection never see half-done.
+    await _get_cache()
+    async with aiosqlite.connect(str(CACHE_PATH)) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        for table in ("exercises", "exercise_muscles", "exercise_equipment", "exercises_fts"):
+            await db.execute(f"DELETE FROM {table}")
+        await db.executemany("INSERT INTO exercises VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        # A muscle listed as both primary and secondary counts as primary
+        await db.executemany(
+            "INSERT INTO exercise_muscles VALUES (?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET is_primary = max(is_primary, excluded.is_primary)",
+            muscles,
+        )
+        await db.executemany("INSERT INTO exercise_equipment VALUES (?, ?)", equipment)
+        await db.executemany(
+            "INSERT INTO exercises_fts (rowid, name, description, category, muscles, equipment) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            fts,
+        )
+        await db.execute(
+            "INSERT OR REPLACE INTO catalogue_meta (key, value) VALUES ('synced_at', ?)",
+            (str(time.time()),),
+        )
+        await db.commit()
+    print(f"wger catalogue synced: {len(rows)} exercises", file=sys.stderr)
+    return len(rows)
+
+
+async def _catalogue_synced_at() -> float | None:
+    db = await _get_cache()
+    async with db.execute("SELECT value FROM catalogue_meta WHERE key = 'synced_at'") as cursor:
+        row = await cursor.fetchone()
+    return float(row[0]) if row else None
+
+
+async def _sync_if_stale() -> None:
+    synced_at = await _catalogue_synced_at()
+    if synced_at and time.time() - synced_at < CATALOGUE_MAX_AGE:
+        return
+    try:
+        await sync_catalogue()
+    except Exception as exc:
+        print(f"wger catalogue sync failed: {exc}", file=sys.stderr)
+
+
+def _fts_query(text: str) -> str:
+    """Free text → FTS5 query: every word must match as a prefix."""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def _row_to_exercise(row) -> dict:
+    return {
+        "id": row[0],
+        "name": row[1],
+        "category": row[2],
+        "description": row[3],
+        "muscles_primary": json.loads(row[4]),
+        "muscles_secondary": json.loads(row[5]),
+        "equipment": json.loads(row[6]),
+        "videos": json.loads(row[7]),
+    }
+
+
+async def search_catalogue(
+    text: str | None = None,
+    muscle_ids: list[int] | None = None,
+    equipment: list[str] | None = None,
+    category: str | None = None,
+    limit: int = 10,
+    offset: int = 0,
+) -> tuple[list[dict], int]:
+    """Filter the local catalogue. Returns (page of exercises, total matches).
+
+    Text matches are ranked by BM25 (name weighted highest); otherwise results
+    are ordered by name.
+    """
+    joins, where, params = [], [], []
+    order = "e.name"
+    if text and _fts_query(text):
+        joins.append("JOIN exercises_fts ON exercises_fts.rowid = e.id")
+        where.append("exercises_fts MATCH ?")
+        params.append(_fts_query(text))
+        order = "bm25(exercises_fts, 10.0, 1.0, 3.0, 3.0, 2.0)"
+    if muscle_ids:
+        marks = ", ".join("?" * len(muscle_ids))
+        where.append(
+            f"e.id IN (SELECT exercise_id FROM exercise_muscles WHERE muscle_id IN ({marks}))"
+        )
+        params += muscle_ids
+    if equipment:
+        likes = " OR ".join("q.name LIKE ?" for _ in equipment)
+        where.append(
+            f"EXISTS (SELECT 1 FROM exercise_equipment q WHERE q.exercise_id = e.id AND ({likes}))"
+        )
+        params += [f"%{e.strip().lower()}%" for e in equipment]
+    if category:
+        where.append("lower(e.category) = ?")
+        params.append(category.strip().lower())
+
+    base = f"FROM exercises e {' '.join(joins)}"
+    if where:
+        base += " WHERE " + " AND ".join(where)
+
+    db = await _get_cache()
+    async with db.execute(f"SELECT count(*) {base}", params) as cursor:
+        total = (await cursor.fetchone())[0]
+    async with db.execute(
+        f"SELECT e.* {base} ORDER BY {order}, e.id LIMIT ? OFFSET ?",
+        [*params, limit, offset],
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return [_row_to_exercise(r) for r in rows], total
+
+
 server = Server("wger")
 
 
@@ -97,6 +436,40 @@ class SearchExercisesTool(BaseModel):
         "Supported values: biceps, triceps, chest, shoulders, lats, upper back, traps, "
         "abs, core, obliques, quadriceps, quads, hamstrings, glutes, calves, brachialis, soleus.",
     )
+    equipment: list[str] = Field(
+        default_factory=list,
+        description="Equipment the user has, e.g. dumbbell, barbell, bodyweight. Matching exercises rank higher.",
+    )
+    limit: int = Field(10, ge=1, le=50, description="Max exercises to return")
+    format: Literal["full", "compact"] = Field(
+        "full",
+        description="'compact' returns one line per exercise instead of JSON.",
+    )
+
+
+class FilterExercisesTool(BaseModel):
+    query: str | None = Field(
+        None,
+        description="Free text matched against exercise name, description, muscles, equipment and category.",
+    )
+    muscle_names: list[str] = Field(
+        default_factory=list,
+        description="Only exercises hitting any of these muscles (same names as search_exercises).",
+    )
+    equipment: list[str] = Field(
+        default_factory=list,
+        description="Only exercises using any of this equipment, e.g. dumbbell, barbell, kettlebell, bench, bodyweight.",
+    )
+    category: str | None = Field(
+        None,
+        description="One of: arms, legs, abs, chest, back, shoulders, calves, cardio.",
+    )
+    limit: int = Field(10, ge=1, le=50, description="Page size")
+    offset: int = Field(0, ge=0, description="Results to skip, for paging")
+    format: Literal["full", "compact"] = Field(
+        "full",
+        description="'compact' returns one line per exercise instead of JSON.",
+    )
 
 
 @server.list_tools()
@@ -107,29 +480,32 @@ async def list_tools() -> list[Tool]:
             description=(
                 "Fetch exercises from Wger that target specific muscle groups - use when the user wants exercises either for muscles or for activities. "
                 "Pass the muscle groups most relevant to the user's activity or goal. "
+                "Exercises hitting more of the requested muscles (primary over secondary) and the user's equipment rank first. "
                 "Returns exercises with name, category, primary/secondary muscles, and equipment."
             ),
             inputSchema=SearchExercisesTool.model_json_schema(),
         ),
+        Tool(
+            name="filter_exercises",
+            description=(
+                "Search the exercise catalogue by free text, muscles, equipment and category. "
+                "Use when the user names equipment they have, a category, or an exercise by name. "
+                "Results are ranked by relevance and paged with limit/offset."
+            ),
+            inputSchema=FilterExercisesTool.model_json_schema(),
+        ),
     ]
 
 
 @server.call_tool()
 async def call_tool(name: str, arguments: dict) -> list[TextContent]:
+    if name == "filter_exercises":
+        return await _filter_exercises(FilterExercisesTool(**arguments))
     if name != "search_exercises":
         return [TextContent(type="text", text=f"Unknown tool: {name}")]
 
-    muscle_names: list[str] = arguments.get("muscle_names", [])
-
-    # Map names → IDs (deduplicated)
-    muscle_ids: set[int] = set()
-    unrecognized: list[str] = []
-    for m in muscle_names:
-        mid = MUSCLE_NAME_TO_ID.get(m.strip().lower())
-        if mid:
-            muscle_ids.add(mid)
-        else:
-            unrecognized.append(m)
+    args = SearchExercisesTool(**arguments)
+    muscle_ids, unrecognized = _muscle_ids(args.muscle_names)
 
     if not muscle_ids:
         return [
@@ -144,74 +520,204 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
             )
         ]
 
-    headers = {"Authorization": f"Token {WGER_API_KEY}"} if WGER_API_KEY else {}
-    seen_ids: set[int] = set()
-    exercises: list[dict] = []
-    print(
-        "Calling wger to get excercises for muscle groups",
-        muscle_names,
-        file=sys.stderr,
-    )
-    async with httpx.AsyncClient(timeout=15) as client:
-        for muscle_id in muscle_ids:
-            resp = await client.get(
-                f"{WGER_BASE}/exerciseinfo/",
-                headers=headers,
-                params={
-                    "format": "json",
-                    "language": 2,
-                    "muscles": muscle_id,
-                    "limit": 10,
-                },
-            )
-            resp.raise_for_status()
+    if await _catalogue_synced_at():
+        exercises = await rank_catalogue(sorted(muscle_ids), args.equipment, args.limit)
+    else:
+        print(
+            "Calling wger to get excercises for muscle groups",
+            args.muscle_names,
+            file=sys.stderr,
+        )
+        per_muscle = await asyncio.gather(*(_fetch_muscle(mid) for mid in sorted(muscle_ids)))
+        exercises = _rank_results(per_muscle, muscle_ids, args.equipment, args.limit)
 
-            for ex in resp.json().get("results", []):
-                if ex["id"] in seen_ids:
-                    continue
-                seen_ids.add(ex["id"])
+    result: dict = {"exercises": exercises, "count": len(exercises)}
+    print("Response from wger: ", [e["name"] for e in exercises], file=sys.stderr)
+    if unrecognized:
+        result["unrecognized_muscles"] = unrecognized
 
-                en = next(
-                    (t for t in ex.get("translations", []) if _is_english(t)), None
-                )
-                if not en or not en.get("name"):
-                    continue
+    return [TextContent(type="text", text=_render(result, args.format))]
 
-                raw_desc = en.get("description", "")
-                videos = [v["video"] for v in ex.get("videos", []) if v.get("video")]
 
-                exercises.append(
-                    {
-                        "id": ex["id"],
-                        "name": en["name"],
-                        "category": ex.get("category", {}).get("name", ""),
-                        "muscles_primary": [
-                            m["name_en"] for m in ex.get("muscles", [])
-                        ],
-                        "muscles_secondary": [
-                            m["name_en"] for m in ex.get("muscles_secondary", [])
-                        ],
-                        "equipment": [e["name"] for e in ex.get("equipment", [])]
-                        or ["bodyweight"],
-                        "description": _strip_html(raw_desc) if raw_desc else "",
-                        "videos": videos,
-                    }
-                )
+# ── Ranking and output ───────────────────────────────────────────────────────
+# Score = 2 per requested muscle hit as primary + 1 per requested muscle hit
+# only as secondary + 1 if the exercise uses any requested equipment. Ties
+# break on name then id, so output doesn't depend on request completion order.
 
-    result: dict = {"exercises": exercises, "count": len(exercises)}
-    print("Response from wger: ", exercises, file=sys.stderr)
+_DESCRIPTION_CHARS = 160
+
+
+def _equipment_matches(equipment: list[str], wanted: list[str]) -> bool:
+    wanted = [w.strip().lower() for w in wanted if w.strip()]
+    return any(w in e.lower() for e in equipment for w in wanted)
+
+
+def _rank_results(
+    per_muscle: list[list[dict]], muscle_ids: set[int], equipment: list[str], limit: int
+) -> list[dict]:
+    """Rank raw exerciseinfo results fetched per muscle from the live API."""
+    scored: dict[int, dict] = {}
+    for results in per_muscle:
+        for ex in results:
+            if ex["id"] in scored:
+                continue
+            entry = _normalize(ex)
+            if not entry:
+                continue
+            primary = {m["id"] for m in ex.get("muscles", [])} & muscle_ids
+            secondary = ({m["id"] for m in ex.get("muscles_secondary", [])} & muscle_ids) - primary
+            entry["score"] = 2 * len(primary) + len(secondary) + (
+                1 if equipment and _equipment_matches(entry["equipment"], equipment) else 0
+            )
+            scored[ex["id"]] = entry
+    ranked = sorted(scored.values(), key=lambda e: (-e["score"], e["name"], e["id"]))
+    return ranked[:limit]
+
+
+async def rank_catalogue(
+    muscle_ids: list[int], equipment: list[str], limit: int
+) -> list[dict]:
+    """Top `limit` catalogue exercises for the muscles, scored as above."""
+    marks = ", ".join("?" * len(muscle_ids))
+    wanted = [f"%{e.strip().lower()}%" for e in equipment if e.strip()]
+    bonus = "0"
+    if wanted:
+        likes = " OR ".join("q.name LIKE ?" for _ in wanted)
+        bonus = (
+            "EXISTS (SELECT 1 FROM exercise_equipment q "
+            f"WHERE q.exercise_id = e.id AND ({likes}))"
+        )
+    db = await _get_cache()
+    async with db.execute(
+        f"""
+        SELECT e.*, sum(CASE WHEN em.is_primary THEN 2 ELSE 1 END) + {bonus} AS score
+        FROM exercise_muscles em
+        JOIN exercises e ON e.id = em.exercise_id
+        WHERE em.muscle_id IN ({marks})
+        GROUP BY e.id
+        ORDER BY score DESC, e.name, e.id
+        LIMIT ?
+        """,
+        [*wanted, *muscle_ids, limit],
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return [{**_row_to_exercise(r), "score": r[8]} for r in rows]
+
+
+def _trim(entry: dict) -> dict:
+    """Only the fields the model uses; descriptions shortened, videos dropped."""
+    desc = entry["description"]
+    if len(desc) > _DESCRIPTION_CHARS:
+        desc = desc[: _DESCRIPTION_CHARS].rsplit(" ", 1)[0] + "…"
+    trimmed = {
+        "id": entry["id"],
+        "name": entry["name"],
+        "category": entry["category"],
+        "primary": entry["muscles_primary"],
+        "secondary": entry["muscles_secondary"],
+        "equipment": entry["equipment"],
+        "description": desc,
+    }
+    if "score" in entry:
+        trimmed["score"] = entry["score"]
+    return trimmed
+
+
+def _render(result: dict, fmt: str) -> str:
+    exercises = [_trim(e) for e in result["exercises"]]
+    if fmt != "compact":
+        return json.dumps({**result, "exercises": exercises}, separators=(",", ":"))
+    lines = [
+        f"{e['name']} [{e['category']}] primary: {', '.join(e['primary']) or '-'}; "
+        f"secondary: {', '.join(e['secondary']) or '-'}; equipment: {', '.join(e['equipment'])}"
+        for e in exercises
+    ]
+    header = f"{result['count']} exercises"
+    if "total" in result:
+        header += f" (of {result['total']}, offset {result['offset']})"
+    if result.get("unrecognized_muscles"):
+        header += f"; unrecognized: {', '.join(result['unrecognized_muscles'])}"
+    return "\n".join([header, *lines])
+
+
+def _muscle_ids(muscle_names: list[str]) -> tuple[set[int], list[str]]:
+    """Map names → IDs (deduplicated). Returns (ids, unrecognized names)."""
+    muscle_ids: set[int] = set()
+    unrecognized: list[str] = []
+    for m in muscle_names:
+        mid = MUSCLE_NAME_TO_ID.get(m.strip().lower())
+        if mid:
+            muscle_ids.add(mid)
+        else:
+            unrecognized.append(m)
+    return muscle_ids, unrecognized
+
+
+async def _filter_exercises(args: FilterExercisesTool) -> list[TextContent]:
+    if not await _catalogue_synced_at():
+        return [
+            TextContent(
+                type="text",
+                text=json.dumps({"error": "Exercise catalogue not synced yet; use search_exercises"}),
+            )
+        ]
+    muscle_ids, unrecognized = _muscle_ids(args.muscle_names)
+    if args.muscle_names and not muscle_ids:
+        return [
+            TextContent(
+                type="text",
+                text=json.dumps(
+                    {"error": "No recognized muscle groups", "unrecognized": unrecognized}
+                ),
+            )
+        ]
+    exercises, total = await search_catalogue(
+        text=args.query,
+        muscle_ids=sorted(muscle_ids),
+        equipment=args.equipment,
+        category=args.category,
+        limit=args.limit,
+        offset=args.offset,
+    )
+    result: dict = {
+        "exercises": exercises,
+        "count": len(exercises),
+        "total": total,
+        "offset": args.offset,
+    }
     if unrecognized:
         result["unrecognized_muscles"] = unrecognized
-
-    return [TextContent(type="text", text=json.dumps(result, indent=2))]
+    return [TextContent(type="text", text=_render(result, args.format))]
 
 
 async def main() -> None:
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream, write_stream, server.create_initialization_options()
-        )
+    # Refresh the local catalogue in the background; searches fall back to
+    # the live API until the first sync lands.
+    sync = asyncio.create_task(_sync_if_stale())
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream, write_stream, server.create_initialization_options()
+            )
+    finally:
+        sync.cancel()
+        if _client is not None:
+            await _client.aclose()
+        if _cache_db is not None:
+            await _cache_db.close()
+
+
+async def _sync_and_close() -> None:
+    try:
+        await sync_catalogue()
+    finally:
+        await _get_client().aclose()
+        if _cache_db is not None:
+            await _cache_db.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if "--sync" in sys.argv:
+        asyncio.run(_sync_and_close())
+    else:
+        asyncio.run(main())